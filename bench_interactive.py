@@ -0,0 +1,88 @@
+"""
+Measures the per-command overhead of the interactive (pexpect) grader.
+
+Every test in the given directories is run through main.run_test twice: once
+with the old fixed 100ms pause after each command, and once synchronized on
+the prompt only. Prints the wall time per command for both.
+
+Usage: python bench_interactive.py <sheet_binary> <test_dir> [<test_dir> ...]
+"""
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from rich.console import Console as RConsole
+from rich.table import Table as RTable
+
+import main
+from compile_utils import get_test_case_pairs
+from runtime_utils import Workspace
+
+OLD_COMMAND_DELAY_S = 0.1
+
+console = RConsole()
+
+
+"""
+Returns a .cmds file that starts with the "rows cols" header. Tests in
+tests/ predate the header, they are run on a full size sheet.
+"""
+def with_header(cmd_file: Path, workspace: Workspace) -> Path:
+    with open(cmd_file) as f:
+        lines = f.readlines()
+    if len(lines[0].split()) == 2 and all(x.isnumeric() for x in lines[0].split()):
+        return cmd_file
+
+    copy = workspace.test_dir(cmd_file) / cmd_file.name
+    with open(copy, "w") as f:
+        f.write("999 18278\n")
+        f.writelines(lines)
+    return copy
+
+
+"""Runs all tests in test_dir, returns (number of commands, seconds, passed)"""
+def bench_dir(bin_path: Path, test_dir: Path, delay: float) -> tuple[int, float, int]:
+    main.COMMAND_DELAY_S = delay
+    marks_mapping = {"marks": defaultdict(float)}
+    num_cmds, total_s, passed = 0, 0.0, 0
+    with Workspace() as workspace:
+        for cmd, expected in get_test_case_pairs(test_dir):
+            cmd = with_header(cmd, workspace)
+            with open(cmd) as f:
+                num_cmds += len(f.readlines()) - 1
+
+            start = time.perf_counter()
+            result = main.run_test(bin_path, cmd, expected, marks_mapping, workspace.test_dir(cmd))
+            total_s += time.perf_counter() - start
+            passed += result.is_pass
+    return num_cmds, total_s, passed
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python bench_interactive.py <sheet_binary> <test_dir> [<test_dir> ...]")
+        sys.exit(1)
+
+    bin_path = Path(sys.argv[1])
+    test_dirs = [Path(d) for d in sys.argv[2:]]
+
+    table = RTable()
+    table.add_column("Test dir", style="cyan")
+    table.add_column("Commands", justify="right")
+    table.add_column("Passed", justify="right")
+    table.add_column("Before (ms/cmd)", justify="right")
+    table.add_column("After (ms/cmd)", justify="right")
+    table.add_column("Speedup", justify="right")
+    for test_dir in test_dirs:
+        num_cmds, before_s, _ = bench_dir(bin_path, test_dir, OLD_COMMAND_DELAY_S)
+        _, after_s, passed = bench_dir(bin_path, test_dir, 0.0)
+        num_cmds = max(num_cmds, 1)
+        table.add_row(
+            str(test_dir),
+            str(num_cmds),
+            str(passed),
+            f"{before_s * 1000 / num_cmds:.2f}",
+            f"{after_s * 1000 / num_cmds:.2f}",
+            f"{before_s / max(after_s, 1e-9):.1f}x",
+        )
+    console.print(table)
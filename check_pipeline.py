@@ -0,0 +1,56 @@
+"""
+Regression run of the pipelined batch grader (eval_batch with more than one
+worker). Grades a few zips whose Makefile fails, so the builder threads keep
+starting make while binaries are already handed to the runner processes, and
+checks that every test of every submission ends up as a compilation error.
+A hang is reported with the stack of every thread instead of waiting forever.
+
+Usage: python check_pipeline.py [num_submissions] [num_workers]
+"""
+import faulthandler
+import sys
+import tempfile
+import zipfile
+from pathlib import Path
+
+import pandas as pd
+
+import main2
+from compile_utils import get_test_case_pairs
+from runtime_utils import eval_batch
+
+TEST_DIR = Path("hidden_tc2/range1")
+TIMEOUT_S = 120
+
+# Each make fails after a different delay, so the first binaries go to the
+# runners while the other builds are still in make
+FAILING_MAKEFILE = "all:\n\tsleep 0.{delay}; false\n"
+
+
+def make_submissions(submission_dir: Path, num_submissions: int):
+    submission_dir.mkdir()
+    for i in range(num_submissions):
+        with zipfile.ZipFile(submission_dir / f"lab1_2023CS1{i:04d}.zip", "w") as zf:
+            zf.writestr("Makefile", FAILING_MAKEFILE.format(delay=i % 9 + 1))
+
+
+if __name__ == "__main__":
+    num_submissions = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+    num_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    faulthandler.dump_traceback_later(TIMEOUT_S, exit=True)
+    with tempfile.TemporaryDirectory(prefix="cop290_check_") as tmp:
+        tmp = Path(tmp)
+        make_submissions(tmp / "submissions", num_submissions)
+        marks_mapping = {"marks": {}, "good_time": {}}
+        eval_batch(
+            main2.run_test, tmp / "submissions", TEST_DIR, marks_mapping, tmp / "marks.csv", True,
+            num_workers=num_workers,
+        )
+        df = pd.read_csv(tmp / "marks.csv")
+    faulthandler.cancel_dump_traceback_later()
+
+    tests = [str(cmd) for cmd, _ in get_test_case_pairs(TEST_DIR)]
+    assert len(df) == num_submissions, f"{len(df)} of {num_submissions} submissions graded"
+    assert (df[tests] == "Compilation error").all().all(), df.to_string()
+    print(f"OK: {num_submissions} failing builds graded with {num_workers} workers")
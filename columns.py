@@ -0,0 +1,74 @@
+"""
+    Column names of the sheet, A..ZZZ, computed once for all 18278 columns,
+    so that the generators and the oracle don't rebuild the same strings for
+    every cell, and the other way round, cell references parsed in bulk.
+    Columns are 0-based.
+"""
+from typing import Sequence
+
+import numpy as np
+
+NUM_COLS = 18278
+MAX_LETTERS = 3
+
+
+def _column_names() -> tuple[str, ...]:
+    letters = [chr(ord("A") + i) for i in range(26)]
+    names = list(letters)
+    previous = letters
+    for _ in range(MAX_LETTERS - 1):
+        previous = [prefix + letter for prefix in previous for letter in letters]
+        names += previous
+    return tuple(names)
+
+
+# COLUMN_NAMES[i] is the name of column i
+COLUMN_NAMES = _column_names()
+
+
+def cell_name(row: int, col: int) -> str:
+    return f"{COLUMN_NAMES[col]}{row + 1}"
+
+
+def parse_cells(refs: Sequence[str] | np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The 0-based rows and columns of cell references like "ABC123", all at
+    once. Both are -1 for anything that isn't 1-3 capital letters followed
+    by a row number without leading zeros.
+    """
+    refs = np.asarray(refs, dtype=np.bytes_)
+    if refs.size == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    width = refs.dtype.itemsize
+    chars = refs.view(np.uint8).reshape(len(refs), width).astype(np.int64)
+    lengths = (chars != 0).sum(axis=1)
+
+    is_letter = (chars >= ord("A")) & (chars <= ord("Z"))
+    is_digit = (chars >= ord("0")) & (chars <= ord("9"))
+    # Letters before the first character that isn't one
+    num_letters = np.cumprod(is_letter, axis=1).sum(axis=1)
+    positions = np.arange(width)
+    in_row = positions >= num_letters[:, None]
+    num_digits = (is_digit & in_row).sum(axis=1)
+
+    cols = np.zeros(len(refs), dtype=np.int64)
+    for pos in range(min(MAX_LETTERS, width)):
+        letter = pos < num_letters
+        cols = np.where(letter, cols * 26 + chars[:, pos] - ord("A") + 1, cols)
+    rows = np.zeros(len(refs), dtype=np.int64)
+    for pos in range(width):
+        digit = in_row[:, pos] & is_digit[:, pos]
+        rows = np.where(digit, rows * 10 + chars[:, pos] - ord("0"), rows)
+
+    first_digit = chars[np.arange(len(refs)), np.minimum(num_letters, width - 1)]
+    valid = (
+        (num_letters >= 1)
+        & (num_letters <= MAX_LETTERS)
+        & (num_digits >= 1)
+        & (num_letters + num_digits == lengths)
+        & (first_digit != ord("0"))
+        # Past 18 digits the row number overflows, no sheet is that tall
+        & (num_digits <= 18)
+    )
+    return np.where(valid, rows - 1, -1), np.where(valid, cols - 1, -1)
@@ -0,0 +1,116 @@
+"""
+    Compiled test cases. Every runner re-parsed the .exp file of every test
+    for every submission; here each .cmds/.exp pair is parsed once and the
+    result is stored in a __tccache__ directory next to the test. It is
+    reused until either file changes.
+"""
+import importlib
+import os
+import pickle
+import sys
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+from compile_utils import get_test_case_pairs
+
+# Bump whenever the output of a parser changes, it invalidates every cache.
+CACHE_VERSION = 2
+CACHE_DIR_NAME = "__tccache__"
+
+
+@dataclass
+class CompiledTestCase:
+    num_rows: int
+    num_cols: int
+    # Byte offset of the first command, right after the "rows cols" header
+    commands_offset: int
+    num_commands: int
+    # Whatever the runner's parser returned for the .exp file
+    expected: Any
+
+
+def _stamp(*files: Path) -> tuple:
+    stamp: tuple = (CACHE_VERSION,)
+    for file in files:
+        st = os.stat(file)
+        stamp += (st.st_mtime_ns, st.st_size)
+    return stamp
+
+
+def _parser_key(parser: Callable[[Path], Any]) -> str:
+    # main2 and main3 both have a parse_exp_file, tell them apart by module
+    module = parser.__module__
+    if module == "__main__":
+        # Run as python main2.py, name it the way this script imports it
+        module = Path(sys.modules["__main__"].__file__).stem
+    return f"{module}.{parser.__qualname__}"
+
+
+def _cache_path(exp_file: Path, parser: Callable[[Path], Any]) -> Path:
+    return exp_file.parent / CACHE_DIR_NAME / f"{exp_file.stem}.{_parser_key(parser)}.pkl"
+
+
+def compile_test_case(cmd_file: Path, exp_file: Path, parser: Callable[[Path], Any]) -> CompiledTestCase:
+    with open(cmd_file, "rb") as f:
+        header = f.readline()
+        num_commands = sum(1 for _ in f)
+    num_rows, num_cols = list(map(lambda x: int(x), header.split()))
+    return CompiledTestCase(num_rows, num_cols, len(header), num_commands, parser(exp_file))
+
+
+def load_test_case(cmd_file: Path, exp_file: Path, parser: Callable[[Path], Any]) -> CompiledTestCase:
+    """
+    Returns the compiled test case, from the cache when it is still fresh.
+    The cache is rebuilt (atomically, workers may race on it) when the
+    .cmds or .exp file changed; read-only test dirs just skip caching.
+    """
+    cmd_file, exp_file = Path(cmd_file), Path(exp_file)
+    cache = _cache_path(exp_file, parser)
+    stamp = _stamp(cmd_file, exp_file)
+    try:
+        with open(cache, "rb") as f:
+            cached_stamp, test_case = pickle.load(f)
+        if cached_stamp == stamp:
+            return test_case
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError, AttributeError):
+        pass
+
+    test_case = compile_test_case(cmd_file, exp_file, parser)
+    try:
+        cache.parent.mkdir(exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cache.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump((stamp, test_case), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache)
+    except OSError:
+        pass
+    return test_case
+
+
+def compile_test_dir(test_dir: Path, parser: Callable[[Path], Any]) -> int:
+    """Compiles every test pair under test_dir ahead of a grading run."""
+    test_cases = get_test_case_pairs(test_dir)
+    for cmd, expected in test_cases:
+        load_test_case(cmd, expected, parser)
+    return len(test_cases)
+
+
+# The parser each runner uses for its .exp files
+PARSERS = {
+    "main": "parse_expected_file",
+    "main2": "parse_exp_file",
+    "main3": "parse_exp_file",
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in PARSERS:
+        print("Usage: python corpus.py [main|main2|main3] [test_dir]")
+        sys.exit(1)
+
+    runner = importlib.import_module(sys.argv[1])
+    parser = getattr(runner, PARSERS[sys.argv[1]])
+    num = compile_test_dir(Path(sys.argv[2]), parser)
+    print(f"Compiled {num} test cases")
@@ -1,16 +1,9 @@
+import os
 import sys
 
-NUM_COL = 18278
-
-def column_to_letter(col):
-    """Convert a column number (1-based) to a spreadsheet-style column letter."""
-    letters = ""
-    while col > 0:
-        col -= 1
-        letters = chr(ord('A') + (col % 26)) + letters
-        col //= 26
-    return letters
-
+# The generator library is in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from testgen import NUM_COLS, NUM_ROWS, repeated_range, write_commands
 
 
 def main(num_cmds, add_reassign, fn, file_path):
@@ -24,18 +17,7 @@ def main(num_cmds, add_reassign, fn, file_path):
     # fn = sys.argv[3]
     # file_path = sys.argv[4]
 
-    with open(file_path, "w") as file:
-        file.write("999 18278\n")
-        file.write("disable_output\n")
-        if add_reassign:
-            file.write(f"B1={2000000}\n")
-        for i in range(num_cmds):
-            file.write(f"A{i+1}={fn}(B1:ALA999)\n")
-        if add_reassign:
-            file.write("B1=1000000\n")
-        file.write("enable_output\n")
-        file.write("q")
-            
+    write_commands(file_path, repeated_range(num_cmds, add_reassign, fn), header=(NUM_ROWS, NUM_COLS))
 
 
 if __name__ == "__main__":
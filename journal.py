@@ -0,0 +1,125 @@
+"""
+    Append-only journal of grading results. Every result is written (and
+    fsynced) as soon as its test finishes, one JSON object per line, so a
+    crashed or interrupted batch can be resumed where it stopped and the
+    marks sheets are materialized from the journal. Results remember the
+    inputs they were graded with, so a re-grade only redoes what changed.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Callable
+
+
+"""
+Hash of everything a result depends on: the contents of the given files
+(directories recursively, in sorted order) plus any extra strings. Stored
+with every journal record to tell which results are stale.
+"""
+def hash_inputs(*paths: Path | None, extra: tuple[str, ...] = ()) -> str:
+    digest = hashlib.sha256()
+    for path in paths:
+        if path is None:
+            digest.update(b"none\0")
+            continue
+        path = Path(path)
+        files = sorted(f for f in path.rglob("*") if f.is_file()) if path.is_dir() else [path]
+        for file in files:
+            data = file.read_bytes()
+            digest.update(f"{file.relative_to(path) if path.is_dir() else file.name}\0{len(data)}\0".encode())
+            digest.update(data)
+    for value in extra:
+        digest.update(f"{value}\0".encode())
+    return digest.hexdigest()
+
+
+class Journal:
+    """
+    Results of a batch by (submission, test). A submission that couldn't be
+    graded at all (bad zip, build failure) has an error instead. Each record
+    carries a hash of its inputs (see hash_inputs); when the inputs are
+    given on lookup, a result recorded for other inputs is stale and is
+    not returned, so only what changed gets graded again.
+
+    The journal is started afresh unless resume is set, then the recorded
+    results are loaded and only those are kept for which keep(result) holds,
+    e.g. to re-run the failed tests; keep gets {"error": ...} for errors.
+    Records are appended with a single O_APPEND write, so worker processes
+    can share one journal.
+    """
+
+    def __init__(self, path: Path, resume: bool = False, keep: Callable[[dict], bool] | None = None):
+        self.path = Path(path).expanduser()
+        # Latest record of every (submission, test) and of every error
+        self._results: dict[str, dict[str, dict]] = {}
+        self._errors: dict[str, dict] = {}
+
+        if resume and self.path.exists():
+            self._load(keep)
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text("")
+
+    def _load(self, keep: Callable[[dict], bool] | None):
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line of a run that was killed mid-write
+                    continue
+                submission = record["submission"]
+                if "error" in record:
+                    if keep is None or keep({"error": record["error"]}):
+                        self._errors[submission] = record
+                    else:
+                        self._errors.pop(submission, None)
+                    continue
+                if keep is None or keep(record["result"]):
+                    self._results.setdefault(submission, {})[record["test"]] = record
+                    # A submission graded after an error was fixed
+                    self._errors.pop(submission, None)
+                else:
+                    self._results.get(submission, {}).pop(record["test"], None)
+
+    def _append(self, record: dict):
+        line = (json.dumps(record) + "\n").encode()
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def record(self, submission: str, test: str, result: dict, inputs: str = ""):
+        record = {"submission": submission, "test": test, "result": result, "inputs": inputs}
+        self._append(record)
+        self._results.setdefault(submission, {})[test] = record
+        self._errors.pop(submission, None)
+
+    def record_error(self, submission: str, error: str, inputs: str = ""):
+        record = {"submission": submission, "error": error, "inputs": inputs}
+        self._append(record)
+        self._errors[submission] = record
+
+    def get(self, submission: str, test: str, inputs: str | None = None) -> dict | None:
+        record = self._results.get(submission, {}).get(test)
+        if record is None or (inputs is not None and record.get("inputs") != inputs):
+            return None
+        return record["result"]
+
+    def error(self, submission: str, inputs: str | None = None) -> str | None:
+        record = self._errors.get(submission)
+        if record is None or (inputs is not None and record.get("inputs") != inputs):
+            return None
+        return record["error"]
+
+    def is_done(self, submission: str, tests: dict[str, str | None], inputs: str | None = None) -> bool:
+        """
+        Whether the submission (with inputs) failed, or every one of tests
+        has an up to date result. tests maps every test to its inputs.
+        """
+        if self.error(submission, inputs) is not None:
+            return True
+        return all(self.get(submission, test, test_inputs) is not None for test, test_inputs in tests.items())
@@ -1,4 +1,5 @@
 from datetime import datetime
+import functools
 import sys
 from pathlib import Path
 import pexpect
@@ -12,13 +13,26 @@ import time
 
 from runtime_utils import *
 from compile_utils import *
+from corpus import load_test_case
 
 
 prompt_regex = r"\[.*] ?\(.*\) ?> ?$"
+# Same prompt, matched anywhere in the stream rather than at the end of what
+# has been read, so that output queued behind it is left for the next read.
+stream_prompt_regex = r"\[[^\]\r\n]*\] ?\([^)\r\n]*\) ?> ?"
 
 # [0.00] (actual_status) > [0.00] (ok) >
 status_line_regex = r"\(([^)]+)\)"
 
+# Fixed pause after sending each command. Reading is synchronized on the
+# prompt, so this is only kept for benchmarking the old behaviour.
+COMMAND_DELAY_S = 0.0
+
+# Pipelined mode writes this many bytes of commands before reading their
+# output. Kept below the pty input buffer (4096 bytes) so the write never
+# blocks on a binary that is itself blocked writing its output.
+PIPELINE_WINDOW_BYTES = 2048
+
 
 def get_status(status_line: str) -> bool:
     match = re.search(r"\(([^)]+)\)", status_line)
@@ -70,77 +84,79 @@ def read_till_prompt(child, timeout) -> tuple[str, str]:
 """
 Runs the commands given in the command file.
 """
-def run_test(bin_path: Path, cmd_file, exp_out_file, marks_mapping):
+def run_test(bin_path: Path, cmd_file, exp_out_file, marks_mapping, scratch_dir: Path, pipelined=False):
+    test_case = load_test_case(cmd_file, exp_out_file, parse_expected_file)
+    num_rows, num_cols = test_case.num_rows, test_case.num_cols
+    with open(cmd_file, "r") as f:
+        f.seek(test_case.commands_offset)
+        commands = f.readlines()
+
     # Start the program
-    log = open("/tmp/cop290_autograderlog.txt", "w")
+    with open(scratch_dir / "log.txt", "w") as log:
+        try:
+            child = pexpect.spawn(
+                str(bin_path), args=[str(num_rows), str(num_cols)], echo=False, encoding="utf-8"
+            )
+        except Exception as e:
+            return TestResult(is_pass=False, reason=f"Couldn't spawn the program {e}", marks=0)
+        child.logfile_read = log
+        # pexpect sleeps 50ms before every send by default; we always wait for
+        # the prompt (or deliberately pipeline) so that pause is pure overhead.
+        child.delaybeforesend = None
 
-    f = open(cmd_file, "r")
-    lines = f.readlines()
-    num_rows, num_cols = list(map(lambda x: int(x), lines[0].split()))
-    commands = lines[1:]
+        try:
+            return run_commands(child, commands, cmd_file, test_case.expected, marks_mapping, pipelined)
+        finally:
+            # pexpect starts the binary in a new session, so its pid is also the
+            # id of the process group holding everything it spawned.
+            kill_process_group(child.pid)
+            child.close(force=True)
 
-    try:
-        child = pexpect.spawn(
-            str(bin_path), args=[str(num_rows), str(num_cols)], echo=False, encoding="utf-8"
-        )
-    except Exception as e:
-        return TestResult(is_pass=False, reason=f"Couldn't spawn the program {e}", marks=0)
-    child.logfile_read = log
 
+"""
+Feeds the commands to a running program and checks every output against
+the .exp file. In pipelined mode commands are written ahead in windows and
+the output is consumed prompt by prompt.
+"""
+def run_commands(child, commands, cmd_file, exp_tables, marks_mapping, pipelined=False) -> TestResult:
     # Expect the spreadsheet that is printed at the start of the program
     try:
         read_till_prompt(child, 10)
     except:
         return TestResult(is_pass=False, reason="Couldn't read the initial prompt", marks=0)
 
-    # Read the command file
-    exp_tables = parse_expected_file(exp_out_file)
     assert len(commands) == len(
         exp_tables
     ), f"Error in test case len(commands)={len(commands)}, len(exp_tables)={len(exp_tables)}"
 
-    # Feed the commands one by one to the program
     start = datetime.now()
-    for i, (cmd, exp) in enumerate(zip(commands, exp_tables)):
-        if (i + 1) % 1000 == 0:
-            end = datetime.now()
-            print(f"Ran {i} commands in {(end-start).total_seconds()} secs")
-            start = datetime.now()
-
-        # Feed command
-        # child.sendline(cmd)
-        child.sendline(cmd.strip("\n"))
-        time.sleep(0.1)
-
-        # Wait for the prompt to appear and read all the output before it.
-        try:
-            output, status_line = read_till_prompt(child, timeout=exp.time + 0.2)
-            # Status line is in the following format:-
-            # [0.00] (ok) > [0.00] (ok) >
-            status_line = status_line.lower()
-            status_is_ok = get_status(status_line)
-        except pexpect.exceptions.TIMEOUT:
-            diff = Diff(time_diff=(cmd.strip(), exp.time))
-            child.sendline("q")
-            print_diff(console, diff, cmd, exp.table, None)
-            return TestResult(is_pass=False, reason="Time limit exceeded", marks=0)
-        except Exception as e:
-            return TestResult(is_pass=False, reason=f"Couldn't send command {cmd.strip()} to the program", marks=0)
-
-        # Split the output by line.
-        output_lines = output.split("\r\n")
-
-        # Remove empty lines
-        output_lines: list[str] = list(filter(lambda x: x != "", output_lines))
-
-        # parse into Table
-        student_table = parse_table(output_lines)
-        # diff with expected table
-        diff = compute_diff(exp, student_table, status_is_ok)
-        if diff is not None:
-            child.sendline("q")
-            print_diff(console, diff, cmd, exp.table, student_table)
-            return TestResult(is_pass=False, reason="Output Incorrect", marks=0)
+    i = 0
+    while i < len(commands):
+        # Feed one command, or in pipelined mode a window of them
+        window = [i]
+        if pipelined:
+            window_bytes = len(commands[i])
+            while i + len(window) < len(commands):
+                window_bytes += len(commands[i + len(window)])
+                if window_bytes > PIPELINE_WINDOW_BYTES:
+                    break
+                window.append(i + len(window))
+        for j in window:
+            # child.sendline(cmd)
+            child.sendline(commands[j].strip("\n"))
+        if COMMAND_DELAY_S:
+            time.sleep(COMMAND_DELAY_S)
+
+        for j in window:
+            if (j + 1) % 1000 == 0:
+                end = datetime.now()
+                print(f"Ran {j} commands in {(end-start).total_seconds()} secs")
+                start = datetime.now()
+
+            result = check_command(child, commands[j], exp_tables[j], stream_prompt_regex if pipelined else prompt_regex)
+            if result is not None:
+                return result
+        i += len(window)
 
     # Quit the program
     child.sendline("q")
@@ -148,8 +164,54 @@ def run_test(bin_path: Path, cmd_file, exp_out_file, marks_mapping):
     return TestResult(is_pass=True, reason="", marks=marks)
 
 
+"""
+Reads the output of one command up to the next prompt and compares it with
+the expected table. Returns the failing TestResult, or None if it matched.
+"""
+def check_command(child, cmd, exp, regex) -> TestResult | None:
+    # Wait for the prompt to appear and read all the output before it.
+    # The next command goes out as soon as the prompt matches.
+    try:
+        child.expect(regex, timeout=exp.time + 0.2)
+        output, status_line = child.before, child.after
+        # Status line is in the following format:-
+        # [0.00] (ok) > [0.00] (ok) >
+        status_line = status_line.lower()
+        status_is_ok = get_status(status_line)
+    except pexpect.exceptions.TIMEOUT:
+        diff = Diff(time_diff=(cmd.strip(), exp.time))
+        child.sendline("q")
+        print_diff(console, diff, cmd, exp.table, None)
+        return TestResult(is_pass=False, reason="Time limit exceeded", marks=0)
+    except Exception as e:
+        return TestResult(is_pass=False, reason=f"Couldn't send command {cmd.strip()} to the program", marks=0)
+
+    # Split the output by line.
+    output_lines = output.split("\r\n")
+
+    # Remove empty lines
+    output_lines: list[str] = list(filter(lambda x: x != "", output_lines))
+
+    # parse into Table
+    student_table = parse_table(output_lines)
+    # diff with expected table
+    diff = compute_diff(exp, student_table, status_is_ok)
+    if diff is not None:
+        child.sendline("q")
+        print_diff(console, diff, cmd, exp.table, student_table)
+        return TestResult(is_pass=False, reason="Output Incorrect", marks=0)
+    return None
+
+
+run_test_pipelined = functools.partial(run_test, pipelined=True)
+
 
 if __name__ == "__main__":
+    # --resume continues an interrupted batch from its journal, --retry-failed
+    # also re-runs what failed
+    resume = "--resume" in sys.argv
+    retry_failed = "--retry-failed" in sys.argv
+    sys.argv = [arg for arg in sys.argv if arg not in ("--resume", "--retry-failed")]
     try:
         # /blah/blah/lab1_entry1_entry2_entry_3
         mode = sys.argv[1]
@@ -160,10 +222,24 @@ if __name__ == "__main__":
             patch_path = True
         except:
             patch_path = False
+        try:
+            num_workers = int(sys.argv[5])
+        except:
+            num_workers = 1
+        try:
+            pipelined = bool(int(sys.argv[6]))
+        except:
+            pipelined = False
+        try:
+            num_builders = int(sys.argv[7])
+        except:
+            num_builders = None
     except Exception as e:
-        print("Usage: python main.py [mode] [submission_dir] [test_dir] [marks_mapping]")
+        print("Usage: python main.py [mode] [submission_dir] [test_dir] [marks_mapping] [num_workers] [pipelined] [num_builders]")
         exit(1)
 
+    test_lambda = run_test_pipelined if pipelined else run_test
+
 
     assert mode in ("batch", "single", "binary", "batch_binary")
     if mode == "batch":
@@ -183,18 +259,19 @@ if __name__ == "__main__":
     marks_mapping = parse_marks_mapping(marks_mapping)
 
     if mode == "batch":
-        eval_batch(run_test, submission, test_dir, marks_mapping, Path("~/lab1_marks.csv"), patch=patch_path)
+        eval_batch(test_lambda, submission, test_dir, marks_mapping, Path("~/lab1_marks.csv"), patch=patch_path, num_workers=num_workers, num_builders=num_builders, resume=resume, retry_failed=retry_failed)
     elif mode == "single":
         entry_nos = submission.name.split("_")[1:]
-        eval_single(run_test, submission, test_dir, entry_nos, marks_mapping, patch=patch_path)
+        eval_single(test_lambda, submission, test_dir, entry_nos, marks_mapping, patch=patch_path)
     elif mode == "binary":
         # submission is the path to the pre-built binary
         test_cases = get_test_case_pairs(test_dir)
+        workspace = Workspace()
         for cmd, expected in test_cases:
             console.print(f"Running {cmd}")
-            result = run_test(submission, cmd, expected, marks_mapping)
+            result = test_lambda(submission, cmd, expected, marks_mapping, workspace.test_dir(cmd))
             console.print(f"{'PASS' if result.is_pass else 'FAIL'}: {result.reason} marks={result.marks}")
     elif mode == "batch_binary":
         # submission is a directory of already-extracted student submissions,
         # each containing a pre-built 'sheet' binary.
-        eval_batch_binary(run_test, submission, test_dir, marks_mapping, Path("lab1_marks.csv"))
+        eval_batch_binary(test_lambda, submission, test_dir, marks_mapping, Path("lab1_marks.csv"), resume, retry_failed)
@@ -3,120 +3,98 @@
 # compares only that.
 
 from pathlib import Path
-import psutil
 import subprocess
 import time
 import sys
 from datetime import datetime
 from compile_utils import *
 from runtime_utils import *
+from corpus import load_test_case
 
 
 def parse_exp_file(exp_file: Path):
     with open(exp_file) as f:
         rows = f.readlines()
-        timeout = int(rows[0])
-        rows = rows[1:]
-        num_cols = -1
-        table = []
-        for row in rows:
-            # First cell is row_idx, ignore that
-            cells = list(map(lambda x: int(x), row.split()[1:]))
-            if num_cols == -1:
-                num_cols = len(cells)
-            else:
-                assert len(cells), num_cols
-
-            table.append(cells)
-
-        return timeout, table, num_cols
+    timeout = int(rows[0])
+    # First cell is row_idx, ignore that
+    parsed = parse_int_rows(rows[1:])
+    assert parsed is not None, f"Rows of {exp_file} have different number of cells"
+    _, table = parsed
+    return timeout, table, table.shape[1]
 
 
 def parse_out_file(out_file: Path, num_rows: int):
-    with open(out_file) as f:
-        rows = f.readlines()
-        # Filter to lines that look like table rows (start with a row index integer).
+    # Only the final table matters; walk the output backwards so that the
+    # time spent does not grow with everything the binary printed before it.
+    rows = []
+    for row in read_lines_reversed(out_file):
+        # Keep only lines that look like table rows (start with a row index integer).
         # This handles binaries that write prompt text to stdout.
-        rows = [r for r in rows if r.split() and r.split()[0].lstrip('-').isdigit()]
-        rows = rows[-num_rows:]
-        num_cols = -1
-        table = []
-        for row in rows:
-            # First cell is row_idx, ignore that
-            try:
-                cells = list(map(lambda x: int(x), row.split()[1:]))
-            except Exception as e:
-                raise e
-            if num_cols == -1:
-                num_cols = len(cells)
-            else:
-                assert len(cells) == num_cols
-
-            table.append(cells)
-
-        return table
-
-
-def compare_table(table1, table2) -> bool:
-    if len(table1) != len(table2):
+        cells = row.split()
+        if cells and cells[0].lstrip('-').isdigit():
+            rows.append(row)
+            if len(rows) == num_rows:
+                break
+    rows.reverse()
+    # First cell is row_idx, ignore that
+    parsed = parse_int_rows(rows)
+    if parsed is None:
+        # Ragged rows can never match the expected table
+        return None
+    return parsed[1]
+
+
+def compare_table(table1: Cells, table2: Cells | None) -> bool:
+    if table2 is None or table1.shape != table2.shape:
         return False
-    for row1, row2 in zip(table1, table2):
-        if row1 != row2:
-            return False
-    return True
+    first_diff, _ = compare_cells(table1, table2)
+    return first_diff is None
 
 
 """
 Runs the commands given in the command file.
 """
-def run_test(bin_path: Path, cmd_file, exp_out_file, marks_mapping) -> TestResult:
-    exp_timeout, exp_table, num_cols = parse_exp_file(exp_out_file)
-    out_file = Path("/tmp/out.txt")
-    outerr_file = Path("/tmp/outerr.txt")
-    max_mem_usage_gb = 0
+def run_test(bin_path: Path, cmd_file, exp_out_file, marks_mapping, scratch_dir: Path) -> TestResult:
+    test_case = load_test_case(cmd_file, exp_out_file, parse_exp_file)
+    exp_timeout, exp_table, _ = test_case.expected
+    num_rows, num_cols = test_case.num_rows, test_case.num_cols
+    out_file = scratch_dir / "out.txt"
+    outerr_file = scratch_dir / "outerr.txt"
 
     if out_file.exists():
         out_file.unlink()
-    with open(out_file, "w") as f:
-        start_time = time.time()
+    with open(out_file, "w") as f, open(outerr_file, "w") as err:
         try:
-            # Read the file and skip the first line
-            with open(cmd_file) as f1:
-                lines = f1.readlines()
-                num_rows, num_cols = list(map(lambda x: int(x), lines[0].split()))
-                commands = "".join(lines[1:])
-
-            temp_in_file = open("/tmp/in.cmds", "w")
-            for line in commands:
-                temp_in_file.write(f"{line}")
-            temp_in_file.close()
-            temp_in_file = open("/tmp/in.cmds", "r")
-
-            process = subprocess.Popen(
-                [str(bin_path), str(num_rows), str(num_cols)],
-                stdin=temp_in_file,
-                stdout=f,
-                stderr=open(outerr_file, "w"),
-            )
-
-            ps_process = psutil.Process(process.pid)
-            while process.poll() is None:
-                mem_info = ps_process.memory_info()
-                max_mem_usage_gb = max(max_mem_usage_gb, mem_info.vms / 2**20)
-                if (time.time() - start_time) > exp_timeout:
-                    return TestResult(is_pass=False, reason="Timeout", time_taken_s=int(time.time() - start_time)*1000, max_mem_gb=max_mem_usage_gb, marks=0)
-                time.sleep(0.001)
-            
-            process.wait()
-            process.kill()
+            # The binary reads the .cmds file itself, starting right after
+            # the header.
+            with open(cmd_file, "rb", buffering=0) as cmds, MemoryProbe() as probe:
+                cmds.seek(test_case.commands_offset)
+                process = probe.popen(
+                    [str(bin_path), str(num_rows), str(num_cols)],
+                    stdin=cmds,
+                    stdout=f,
+                    stderr=err,
+                    start_new_session=True,
+                )
+
+                try:
+                    timed_out, time_taken, _ = supervise(process, exp_timeout)
+                finally:
+                    # The binary runs in its own process group; kill exactly that
+                    # group, including anything it left running, and reap it.
+                    kill_process_group(process.pid)
+                    process.wait()
+                max_mem_usage_gb = probe.peak_mb()
         except FileNotFoundError:
             return TestResult(is_pass=False, reason="Compilation error", marks=0)
         f.flush()
 
-    out_table = parse_out_file(out_file, len(exp_table))
+    if timed_out:
+        return TestResult(is_pass=False, reason="Timeout", time_taken_s=time_taken*1000, max_mem_gb=max_mem_usage_gb, marks=0)
+
+    out_table = parse_out_file(out_file, exp_table.shape[0])
     if not compare_table(exp_table, out_table):
         return TestResult(is_pass=False, reason="Wrong output", marks=0)
-    time_taken = (time.time() - start_time)
 
     cmd_file = str(cmd_file)
     marks = marks_mapping['marks'][cmd_file]
@@ -165,6 +143,11 @@ def run_test(bin_path: Path, cmd_file, exp_out_file, marks_mapping) -> TestResul
 
 
 if __name__ == "__main__":
+    # --resume continues an interrupted batch from its journal, --retry-failed
+    # also re-runs what failed
+    resume = "--resume" in sys.argv
+    retry_failed = "--retry-failed" in sys.argv
+    sys.argv = [arg for arg in sys.argv if arg not in ("--resume", "--retry-failed")]
     try:
         # /blah/blah/lab1_entry1_entry2_entry_3
         mode = sys.argv[1]
@@ -175,9 +158,17 @@ if __name__ == "__main__":
             apply_patch = bool(sys.argv[5])
         except:
             apply_patch = False
+        try:
+            num_workers = int(sys.argv[6])
+        except:
+            num_workers = 1
+        try:
+            num_builders = int(sys.argv[7])
+        except:
+            num_builders = None
     except:
         print(
-            "Usage: python main.py [mode] [submission_dir] [test_dir] [marks_mapping]"
+            "Usage: python main.py [mode] [submission_dir] [test_dir] [marks_mapping] [apply_patch] [num_workers] [num_builders]"
         )
         exit(1)
 
@@ -198,15 +189,16 @@ if __name__ == "__main__":
     # tc_name -> marks
     marks_mapping = parse_marks_mapping(marks_mapping)
     if mode == "batch":
-        eval_batch(run_test, submission, test_dir, marks_mapping, Path("~/lab1_marks2.csv"), True, patch=apply_patch)
+        eval_batch(run_test, submission, test_dir, marks_mapping, Path("~/lab1_marks2.csv"), True, patch=apply_patch, num_workers=num_workers, num_builders=num_builders, resume=resume, retry_failed=retry_failed)
     elif mode == "single":
         entry_nos = submission.name.split("_")[1:]
         eval_single(run_test, submission, test_dir, entry_nos, marks_mapping, patch=apply_patch)
     elif mode == "binary":
         test_cases = get_test_case_pairs(test_dir)
+        workspace = Workspace()
         for cmd, expected in test_cases:
             console.print(f"Running {cmd}")
-            result = run_test(submission, cmd, expected, marks_mapping)
+            result = run_test(submission, cmd, expected, marks_mapping, workspace.test_dir(cmd))
             console.print(f"{'PASS' if result.is_pass else 'FAIL'}: {result.reason} marks={result.marks:.2f} time={result.time_taken_s:.0f}ms mem={result.max_mem_gb:.1f}MB")
     elif mode == "batch_binary":
-        eval_batch_binary(run_test, submission, test_dir, marks_mapping, Path("lab1_marks2.csv"))
+        eval_batch_binary(run_test, submission, test_dir, marks_mapping, Path("lab1_marks2.csv"), resume, retry_failed)
@@ -1,65 +1,295 @@
+import contextlib
+import fcntl
+import hashlib
 import subprocess
 import shutil
 import json
+import re
 import tempfile
+import time
 import os
 import sys
 
+# Persistent crate copies for warm runs, see warm_crate.
+WARM_CACHE_DIR = os.environ.get(
+    "MAJOR_WARM_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "cop290_autograder", "major")
+)
 
-def run_autograder(student_file, template_dir):
+
+@contextlib.contextmanager
+def fresh_crate(template_dir):
     # 1. Make a temporary directory
     with tempfile.TemporaryDirectory() as tempdir:
         # 2. Copy template project into tempdir
         shutil.copytree(template_dir, tempdir, dirs_exist_ok=True)
+        yield tempdir
+
+
+def template_cache_dir(template_dir):
+    """Directory for the persistent builds of template_dir, keyed on its Cargo.toml/Cargo.lock."""
+    digest = hashlib.sha256(os.path.abspath(template_dir).encode())
+    for manifest in ("Cargo.toml", "Cargo.lock"):
+        path = os.path.join(template_dir, manifest)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    name = os.path.basename(os.path.normpath(template_dir))
+    base = os.path.join(WARM_CACHE_DIR, f"{name}-{digest.hexdigest()[:16]}")
+    os.makedirs(base, exist_ok=True)
+    return base
+
+
+@contextlib.contextmanager
+def warm_crate(template_dir):
+    """
+    Yields a persistent copy of template_dir. Its target/ directory survives
+    between runs, so cargo reuses the template's dependencies and only
+    rebuilds the student's lib.rs and the tests. Every copy is held by one
+    run at a time (flock), concurrent runs get a copy each.
+    """
+    base = template_cache_dir(template_dir)
+
+    slot = 0
+    while True:
+        lock = open(os.path.join(base, f"slot{slot}.lock"), "w")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            break
+        except BlockingIOError:
+            lock.close()
+            slot += 1
+
+    try:
+        crate_dir = os.path.join(base, f"slot{slot}")
+        # Refresh everything but the build outputs, the tests may have changed
+        shutil.copytree(template_dir, crate_dir, dirs_exist_ok=True, ignore=shutil.ignore_patterns("target"))
+        yield crate_dir
+    finally:
+        lock.close()
+
+
+# Building the tests gets its own generous budget, the 2 seconds are for
+# running them only.
+COMPILE_TIMEOUT_S = 120
+TEST_TIMEOUT_S = 2
+
+
+def build_tests(crate_dir, env):
+    """
+    Builds the test binaries without running them. Returns their paths, or
+    None and the compiler output if the build failed.
+    """
+    result = subprocess.run(
+        ["cargo", "+nightly", "test", "hidden_tests", "--no-run", "--message-format=json"],
+        cwd=crate_dir,
+        capture_output=True,
+        text=True,
+        timeout=COMPILE_TIMEOUT_S,
+        env=env
+    )
+    executables, diagnostics = parse_build_messages(result.stdout)
+    if result.returncode != 0:
+        return None, "".join(sum(diagnostics.values(), [])) + result.stderr
+    return sum(executables.values(), []), ""
+
+
+def parse_build_messages(stdout):
+    """
+    Reads cargo's --message-format=json output. Returns the test executables
+    and the rendered compiler diagnostics, both by package directory.
+    """
+    executables = {}
+    diagnostics = {}
+    for line in stdout.splitlines():
+        try:
+            obj = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if "manifest_path" not in obj:
+            continue
+        package_dir = os.path.dirname(obj["manifest_path"])
+        if obj.get("reason") == "compiler-artifact" and obj.get("executable") and obj["profile"]["test"]:
+            executables.setdefault(package_dir, []).append(obj["executable"])
+        if obj.get("reason") == "compiler-message":
+            diagnostics.setdefault(package_dir, []).append(obj["message"]["rendered"])
+    return executables, diagnostics
+
+
+def run_tests(executables, crate_dir, env):
+    """
+    Runs the test binaries with JSON output, like cargo test would, all of
+    them within TEST_TIMEOUT_S. Returns (passed, failed, run_s).
+    """
+    stdout, stderr = "", ""
+    start = time.perf_counter()
+    for executable in executables:
+        remaining = TEST_TIMEOUT_S - (time.perf_counter() - start)
+        try:
+            result = subprocess.run(
+                [executable, "hidden_tests", "-Z", "unstable-options", "--format", "json"],
+                cwd=crate_dir,
+                capture_output=True,
+                text=True,
+                timeout=max(remaining, 0),
+                env=env
+            )
+        except subprocess.TimeoutExpired:
+            return 0, [f"Test took more than {TEST_TIMEOUT_S} seconds"], time.perf_counter() - start
+        stdout += result.stdout
+        stderr += result.stderr
+    run_s = time.perf_counter() - start
 
+    failed = []
+    passed = 0
+    for line in stdout.splitlines():
+        try:
+            obj = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if obj.get("type") == "test":
+            if obj.get("event") == "ok":
+                passed += 1
+            if obj.get("event") == "failed":
+                failed.append(obj)
+
+    # If failed is empty and no test cases passed => The tests didn't run.
+    if len(failed) == 0 and passed==0:
+        return 0, [stderr], run_s
+    return passed, failed, run_s
+
+
+def run_autograder_timed(student_file, template_dir, warm=False):
+    """Like run_autograder, also returns the seconds spent compiling and running the tests."""
+    crate = warm_crate(template_dir) if warm else fresh_crate(template_dir)
+    with crate as tempdir:
         # 3. Replace src/lib.rs with student's file
         src_lib = os.path.join(tempdir, "src", "lib.rs")
         shutil.copy(student_file, src_lib)
 
-        # 4. Run cargo test with JSON output
+        # 4. Build the tests
+        env = os.environ.copy()
+        env["RUSTFLAGS"] = "-Awarnings"
+        start = time.perf_counter()
+        try:
+            executables, compile_errors = build_tests(tempdir, env)
+        except subprocess.TimeoutExpired:
+            return 0, [f"Compilation took more than {COMPILE_TIMEOUT_S} seconds"], time.perf_counter() - start, 0
+        compile_s = time.perf_counter() - start
+        if executables is None:
+            return 0, [compile_errors], compile_s, 0
+
+        # 5. Run the tests and parse their JSON output
+        passed, failed, run_s = run_tests(executables, tempdir, env)
+        return passed, failed, compile_s, run_s
+
+
+def run_autograder(student_file, template_dir, warm=False):
+    passed, failed, _, _ = run_autograder_timed(student_file, template_dir, warm)
+    return passed, failed
+
+
+def write_member(template_dir, member_dir, member_name, student_file):
+    """
+    Lays out one student's crate in the workspace: the template with its
+    package renamed to member_name. The library keeps the name template, so
+    the tests' `use template::...` still resolve.
+    """
+    shutil.copytree(
+        template_dir, member_dir, dirs_exist_ok=True, ignore=shutil.ignore_patterns("target", "Cargo.lock")
+    )
+    with open(os.path.join(template_dir, "Cargo.toml")) as f:
+        manifest = f.read()
+    manifest = re.sub(r'(?m)^name\s*=\s*"[^"]*"', f'name = "{member_name}"', manifest, count=1)
+    manifest += '\n[lib]\nname = "template"\npath = "src/lib.rs"\n'
+    with open(os.path.join(member_dir, "Cargo.toml"), "w") as f:
+        f.write(manifest)
+    shutil.copy(student_file, os.path.join(member_dir, "src", "lib.rs"))
+
+
+def run_autograder_batch(student_files, template_dir):
+    """
+    Grades every student's solution to one question with a single cargo
+    build. A persistent workspace holds one member crate per student, all
+    sharing one target dir, so the dependencies are built once per question.
+    Every member's test binaries then run on their own. student_files maps
+    student id -> .rs file, returns student id -> (passed, failed, compile_s,
+    run_s) where compile_s is the student's share of the build.
+    """
+    base = template_cache_dir(template_dir)
+    # cargo reports resolved manifest paths
+    workspace_dir = os.path.realpath(os.path.join(base, "workspace"))
+    members_dir = os.path.join(workspace_dir, "members")
+    os.makedirs(members_dir, exist_ok=True)
+
+    with open(os.path.join(base, "workspace.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        # Package names must be unique and valid identifiers
+        members = {}
+        for student_id in student_files:
+            name = "student_" + re.sub(r"[^A-Za-z0-9_]", "_", student_id)
+            while name in members.values():
+                name += "_"
+            members[student_id] = name
+        for stale in set(os.listdir(members_dir)) - set(members.values()):
+            shutil.rmtree(os.path.join(members_dir, stale))
+        for student_id, name in members.items():
+            write_member(template_dir, os.path.join(members_dir, name), name, student_files[student_id])
+
+        with open(os.path.join(workspace_dir, "Cargo.toml"), "w") as f:
+            f.write("[workspace]\nresolver = \"3\"\nmembers = [\n")
+            f.writelines(f'    "members/{name}",\n' for name in members.values())
+            f.write("]\n")
+        if os.path.exists(os.path.join(template_dir, "Cargo.lock")):
+            shutil.copy(os.path.join(template_dir, "Cargo.lock"), os.path.join(workspace_dir, "Cargo.lock"))
+
+        # cargo test can't keep going past a member that doesn't compile,
+        # cargo build --tests builds the same test binaries and can.
         env = os.environ.copy()
         env["RUSTFLAGS"] = "-Awarnings"
+        start = time.perf_counter()
         try:
             result = subprocess.run(
-                ["cargo", "+nightly", "test", "hidden_tests", "--", "-Z", "unstable-options", "--format", "json"],
-                cwd=tempdir,
+                ["cargo", "+nightly", "build", "--workspace", "--tests", "--keep-going", "--message-format=json"],
+                cwd=workspace_dir,
                 capture_output=True,
                 text=True,
-                timeout=2,
+                timeout=COMPILE_TIMEOUT_S * len(members),
                 env=env
             )
         except subprocess.TimeoutExpired:
-            return 0, ["Test took more than 2 seconds"]
-
+            # Someone's code doesn't compile in time, find out whose the slow way
+            lock.close()
+            return {
+                student_id: run_autograder_timed(student_file, template_dir, warm=True)
+                for student_id, student_file in student_files.items()
+            }
+        compile_s = (time.perf_counter() - start) / max(len(members), 1)
+        executables, diagnostics = parse_build_messages(result.stdout)
 
-        # 6. Parse the JSON output
-        failed = []
-        passed = 0
-        for line in result.stdout.splitlines():
-            try:
-                obj = json.loads(line)
-            except json.JSONDecodeError:
+        results = {}
+        for student_id, name in members.items():
+            member_dir = os.path.join(members_dir, name)
+            if member_dir in diagnostics and any(d.startswith("error") for d in diagnostics[member_dir]):
+                results[student_id] = (0, ["".join(diagnostics[member_dir])], compile_s, 0)
                 continue
-            if obj.get("type") == "test":
-                if obj.get("event") == "ok":
-                    passed += 1
-                if obj.get("event") == "failed":
-                    failed.append(obj)
-
-        # If failed is empty and no test cases passed => There was a compile error.
-        if len(failed) == 0 and passed==0:
-            return 0, [result.stderr]
-        return passed, failed
+            if member_dir not in executables:
+                results[student_id] = (0, [result.stderr], compile_s, 0)
+                continue
+            passed, failed, run_s = run_tests(executables[member_dir], member_dir, env)
+            results[student_id] = (passed, failed, compile_s, run_s)
+        return results
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python3 autograder.py <student_q1.rs> <total_tests>")
+    warm = "--warm" in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != "--warm"]
+    if len(args) != 2:
+        print("Usage: python3 autograder.py <student_q1.rs> <template_dir> [--warm]")
 
-    student_file = sys.argv[1]
-    template_dir = sys.argv[2]
+    student_file = args[0]
+    template_dir = args[1]
 
-    passed, failed = run_autograder(student_file, template_dir)
+    passed, failed, compile_s, run_s = run_autograder_timed(student_file, template_dir, warm)
     print("Test cases passed:- ", passed)
     print("Failure reason:- ", failed)
-
-
+    print(f"Compile time:- {compile_s:.2f}s, run time:- {run_s:.2f}s")
@@ -1,8 +1,17 @@
+import contextlib
 import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import autograder
 import pandas as pd
+import psutil
 import tqdm
 
+# The results journal is shared with the lab1 graders one directory up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from journal import Journal, hash_inputs
+
 submissions_dir = "major_submissions"
 # TODO: Currently all test in a question has equal weightage.
 template_dirs = {
@@ -16,82 +25,215 @@ template_dirs = {
     "q8": ("major_templates/q8_template", 6, 37),
 }
 
-results = {}
+# Peak memory of one cargo build + test run, bounds the pool on small hosts
+MEM_PER_JOB_GB = 1.5
+
+
+def pool_size():
+    """As many concurrent jobs as there are cores, unless memory runs out first."""
+    num_cpus = os.cpu_count() or 1
+    available_gb = psutil.virtual_memory().available / 2**30
+    return max(1, min(num_cpus, int(available_gb // MEM_PER_JOB_GB)))
+
+
+@contextlib.contextmanager
+def cargo_jobserver(num_jobs, num_workers):
+    """
+    A make-style jobserver (a named fifo holding tokens) for every cargo the
+    pool starts, found through CARGO_MAKEFLAGS. Parallel builds together
+    then run at most num_jobs rustc processes instead of num_jobs each.
+    CARGO_BUILD_JOBS is a per build share for a cargo that can't use it.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        fifo = os.path.join(tmp, "jobserver")
+        os.mkfifo(fifo)
+        # Held open so the tokens outlive the cargo processes using them
+        fd = os.open(fifo, os.O_RDWR)
+        # Every cargo already owns one implicit token
+        os.write(fd, b"+" * max(num_jobs - num_workers, 0))
+        saved = {k: os.environ.get(k) for k in ("CARGO_MAKEFLAGS", "CARGO_BUILD_JOBS")}
+        os.environ["CARGO_MAKEFLAGS"] = f"-j{num_jobs} --jobserver-auth=fifo:{fifo}"
+        os.environ["CARGO_BUILD_JOBS"] = str(max(num_jobs // num_workers, 1))
+        try:
+            yield
+        finally:
+            for k, v in saved.items():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+            os.close(fd)
+
+
+def template_hash(template_dir):
+    """Hash of what a template contributes to the grade, its src/lib.rs is the student's."""
+    files = [os.path.join(template_dir, name) for name in ("Cargo.toml", "Cargo.lock", "tests")]
+    return hash_inputs(*(f for f in files if os.path.exists(f)))
+
+
+def grade_question(student_file, template_dir):
+    return autograder.run_autograder_timed(student_file, template_dir, warm=True)
+
+
+def grade_question_batch(question, student_files, template_dir):
+    results = autograder.run_autograder_batch(student_files, template_dir)
+    return {(student_id, question): result for student_id, result in results.items()}
+
 
-for student_id in tqdm.tqdm(os.listdir(submissions_dir)):
-    student_path = os.path.join(submissions_dir, student_id)
-    if not os.path.isdir(student_path):
-        continue
+def _all_passed(result):
+    return "failed" in result and not result["failed"]
 
-    results[student_id] = {}
 
-    for question, (template_dir, marks, num_tests) in template_dirs.items():
-        student_file = os.path.join(student_path, f"{question}.rs")
-        # student_file = os.path.join("major_sol/", f"{question}.rs")
+def main(workspace_mode=False, resume=False, retry_failed=False):
+    # Every graded (student, question) is journaled as soon as it is known, so
+    # an interrupted run can be resumed; the sheets are filled from it. Each
+    # result remembers the student file and template it was graded with, a
+    # resumed run re-grades those that changed.
+    journal = Journal(
+        "major_marks.jsonl",
+        resume=resume or retry_failed,
+        keep=_all_passed if retry_failed else None,
+    )
+    results = {}
+    # Seconds spent compiling and running each question, to size the grading hosts
+    timings = {}
 
-        if not os.path.exists(student_file):
+    # One job per (student, question)
+    jobs = []
+    for student_id in os.listdir(submissions_dir):
+        student_path = os.path.join(submissions_dir, student_id)
+        if not os.path.isdir(student_path):
             continue
 
-        passed, failed_tests = autograder.run_autograder(student_file, template_dir)
-        results[student_id][f"{question}_marks"] = (passed * marks) / num_tests
-        results[student_id][f"{question}_failed_tests"] = failed_tests
-    # break
-
-df = pd.DataFrame(results)
-df = df.transpose()  # swap rows and columns
-df = df.reset_index().rename(columns={"index": "entry_no"})
-df = df.fillna(0)
-
-# print(df)
-df["total"] = (
-    df["q1_marks"]
-    + df["q2_marks"]
-    + df["q3_marks"]
-    + df["q4_marks"]
-    + df["q5_marks"]
-    + df["q6_marks"]
-    + df["q7_marks"]
-    + df["q8_marks"]
-)
-df["feedback"] = f"""
-----------------------------\n
-Q1:
-    {df["q1_failed_tests"]}
-----------------------------\n
-Q2:
-    {df["q2_failed_tests"]}
-----------------------------\n
-Q3:
-    {df["q3_failed_tests"]}
-----------------------------\n
-Q4:
-    {df["q4_failed_tests"]}
-----------------------------\n
-Q5:
-    {df["q5_failed_tests"]}
-----------------------------\n
-Q6:
-    {df["q6_failed_tests"]}
-----------------------------\n
-Q7:
-    {df["q7_failed_tests"]}
-----------------------------\n
-Q8:
-    {df["q8_failed_tests"]}
-----------------------------\n
-# """
-df = df.drop(
-    columns=[
-        "q1_failed_tests",
-        "q2_failed_tests",
-        "q3_failed_tests",
-        "q4_failed_tests",
-        "q5_failed_tests",
-        "q6_failed_tests",
-        "q7_failed_tests",
-        "q8_failed_tests",
-        "feedback"
-    ]
-)
-df.to_excel("major_marks.xlsx")
-df.to_csv("major_marks.csv")
+        results[student_id] = {}
+        timings[student_id] = {}
+
+        for question, (template_dir, marks, num_tests) in template_dirs.items():
+            student_file = os.path.join(student_path, f"{question}.rs")
+            # student_file = os.path.join("major_sol/", f"{question}.rs")
+
+            if not os.path.exists(student_file):
+                continue
+            jobs.append((student_id, question, student_file, template_dir))
+
+    template_hashes = {question: template_hash(template_dir) for question, (template_dir, _, _) in template_dirs.items()}
+    inputs = {
+        (student_id, question): hash_inputs(student_file, extra=(template_hashes[question],))
+        for student_id, question, student_file, _ in jobs
+    }
+    pending = [job for job in jobs if journal.get(job[0], job[1], inputs[job[0], job[1]]) is None]
+
+    def record(student_id, question, graded):
+        passed, failed_tests, compile_s, run_s = graded
+        journal.record(
+            student_id,
+            question,
+            {"passed": passed, "failed": failed_tests, "compile_s": compile_s, "run_s": run_s},
+            inputs[student_id, question],
+        )
+
+    num_workers = pool_size()
+    with cargo_jobserver(os.cpu_count() or 1, num_workers), ProcessPoolExecutor(max_workers=num_workers) as pool:
+        if workspace_mode:
+            # One cargo workspace, and so one job, per question
+            student_files = {}
+            for student_id, question, student_file, template_dir in pending:
+                student_files.setdefault(question, {})[student_id] = student_file
+            futures = [
+                pool.submit(grade_question_batch, question, files, template_dirs[question][0])
+                for question, files in student_files.items()
+            ]
+            for future in tqdm.tqdm(as_completed(futures), total=len(futures)):
+                for (student_id, question), graded in future.result().items():
+                    record(student_id, question, graded)
+        else:
+            futures = {
+                pool.submit(grade_question, student_file, template_dir): (student_id, question)
+                for student_id, question, student_file, template_dir in pending
+            }
+            for future in tqdm.tqdm(as_completed(futures), total=len(futures)):
+                record(*futures[future], future.result())
+
+    # Filled in job order, so the sheet doesn't depend on which job finished first
+    for student_id, question, _, _ in jobs:
+        _, marks, num_tests = template_dirs[question]
+        graded = journal.get(student_id, question)
+        timings[student_id][f"{question}_compile_s"] = graded["compile_s"]
+        timings[student_id][f"{question}_run_s"] = graded["run_s"]
+        results[student_id][f"{question}_marks"] = (graded["passed"] * marks) / num_tests
+        results[student_id][f"{question}_failed_tests"] = graded["failed"]
+
+    df = pd.DataFrame(results)
+    df = df.transpose()  # swap rows and columns
+    df = df.reset_index().rename(columns={"index": "entry_no"})
+    df = df.fillna(0)
+
+    # print(df)
+    df["total"] = (
+        df["q1_marks"]
+        + df["q2_marks"]
+        + df["q3_marks"]
+        + df["q4_marks"]
+        + df["q5_marks"]
+        + df["q6_marks"]
+        + df["q7_marks"]
+        + df["q8_marks"]
+    )
+    df["feedback"] = f"""
+    ----------------------------\n
+    Q1:
+        {df["q1_failed_tests"]}
+    ----------------------------\n
+    Q2:
+        {df["q2_failed_tests"]}
+    ----------------------------\n
+    Q3:
+        {df["q3_failed_tests"]}
+    ----------------------------\n
+    Q4:
+        {df["q4_failed_tests"]}
+    ----------------------------\n
+    Q5:
+        {df["q5_failed_tests"]}
+    ----------------------------\n
+    Q6:
+        {df["q6_failed_tests"]}
+    ----------------------------\n
+    Q7:
+        {df["q7_failed_tests"]}
+    ----------------------------\n
+    Q8:
+        {df["q8_failed_tests"]}
+    ----------------------------\n
+    # """
+    df = df.drop(
+        columns=[
+            "q1_failed_tests",
+            "q2_failed_tests",
+            "q3_failed_tests",
+            "q4_failed_tests",
+            "q5_failed_tests",
+            "q6_failed_tests",
+            "q7_failed_tests",
+            "q8_failed_tests",
+            "feedback"
+        ]
+    )
+    df.to_excel("major_marks.xlsx")
+    df.to_csv("major_marks.csv")
+
+    timings_df = pd.DataFrame(timings).transpose()
+    timings_df = timings_df.reset_index().rename(columns={"index": "entry_no"})
+    timings_df.to_csv("major_timings.csv")
+    print(timings_df.describe())
+
+
+if __name__ == "__main__":
+    # --workspace: build all students' solutions to a question in one cargo workspace
+    # --resume: continue from major_marks.jsonl, --retry-failed: also re-grade
+    # the questions that didn't pass every test
+    main(
+        workspace_mode="--workspace" in sys.argv,
+        resume="--resume" in sys.argv,
+        retry_failed="--retry-failed" in sys.argv,
+    )
@@ -0,0 +1,50 @@
+"""
+    Runs a command as a child of this process and writes the command's peak
+    resident memory (ru_maxrss of the child, as the kernel reports it) to a
+    file descriptor once the command exits; exits the way the command did.
+
+    The graders start binaries through this script (see MemoryProbe): the
+    ru_maxrss of a process forked from the grader counts every grader page
+    that was resident at the fork, while this interpreter only holds a few
+    MiB. Run it with -I -S so nothing else is imported.
+
+    Usage: python -I -S maxrss.py <fd> <command> [<arg> ...]
+"""
+import os
+import resource
+import signal
+import sys
+
+
+def main():
+    fd = int(sys.argv[1])
+    command = sys.argv[2:]
+
+    pid = os.fork()
+    if pid == 0:
+        os.close(fd)
+        # Python ignores these, the command gets the default actions back,
+        # like Popen(restore_signals=True) does
+        for sig in (signal.SIGPIPE, signal.SIGXFSZ):
+            signal.signal(sig, signal.SIG_DFL)
+        try:
+            os.execvp(command[0], command)
+        except OSError as e:
+            print(f"{command[0]}: {e.strerror}", file=sys.stderr)
+        os._exit(127)
+
+    _, status, rusage = os.wait4(pid, 0)
+    os.write(fd, f"{rusage.ru_maxrss}\n".encode())
+    os.close(fd)
+
+    if os.WIFSIGNALED(status):
+        # Die of the same signal, without a core dump of this script
+        sig = os.WTERMSIG(status)
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+        signal.signal(sig, signal.SIG_DFL)
+        os.kill(os.getpid(), sig)
+    sys.exit(os.waitstatus_to_exitcode(status))
+
+
+if __name__ == "__main__":
+    main()
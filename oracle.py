@@ -0,0 +1,658 @@
+"""
+    Reference evaluator for the sheet command language. It runs a .cmds file
+    the way a correct sheet binary does and writes the .exp file for it,
+    either per command (main.py) or the final table with a time budget
+    (main2.py/main3.py), so generated tests get trustworthy expected outputs.
+"""
+import re
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterator
+
+import numpy as np
+
+from columns import COLUMN_NAMES, cell_name, parse_cells
+from compile_utils import get_test_case_pairs
+
+# Sheets of tests without a "rows cols" header, see bench_interactive.py
+DEFAULT_SHAPE = (999, 18278)
+VIEWPORT = 10
+# The sheet stores C ints, an expected output can't rely on values beyond
+INT_MIN, INT_MAX = -2**31, 2**31 - 1
+CHUNK_SEPARATOR = "*******************\n"
+
+FUNCTIONS = ("MIN", "MAX", "SUM", "AVG", "STDEV")
+
+_CELL = r"[A-Z]{1,3}[0-9]+"
+_OPERAND = rf"(?:{_CELL}|-?[0-9]+)"
+# Anything that may be meant as a cell, parse_cells tells which are
+_REF_RE = re.compile(r"[A-Z]+[0-9]+")
+_VALUE_RE = re.compile(rf"({_OPERAND})")
+_BINARY_RE = re.compile(rf"({_OPERAND})([-+*/])({_OPERAND})")
+_RANGE_RE = re.compile(rf"({'|'.join(FUNCTIONS)})\(({_CELL}):({_CELL})\)")
+_SLEEP_RE = re.compile(rf"SLEEP\(({_OPERAND})\)")
+_ASSIGN_RE = re.compile(rf"({_CELL})=(.+)")
+
+type Cell = tuple[int, int]
+# A constant or the cell it refers to
+type Operand = int | Cell
+
+
+@dataclass(frozen=True)
+class Formula:
+    # "=" (plain value), "+", "-", "*", "/", "SLEEP" or one of FUNCTIONS
+    op: str
+    # The operands, or for range functions the top-left and bottom-right cells
+    args: tuple[Operand, ...]
+
+    @property
+    def is_range(self) -> bool:
+        return self.op in FUNCTIONS
+
+    def refs(self) -> list[Cell]:
+        """The cells this formula reads, ranges as their two corners."""
+        return [arg for arg in self.args if not isinstance(arg, int)]
+
+    def reads(self, cell: Cell) -> bool:
+        if self.is_range:
+            (r0, c0), (r1, c1) = self.args
+            return r0 <= cell[0] <= r1 and c0 <= cell[1] <= c1
+        return cell in self.args
+
+
+class RangeIndex:
+    """
+    The rectangles read by the range formulas of a sheet, so that the range
+    formulas reading a cell are found with one vectorized comparison
+    instead of a scan over every formula.
+    """
+
+    # Bounds of a free slot, no cell is inside
+    EMPTY = (np.iinfo(np.int64).max, np.iinfo(np.int64).max, -1, -1)
+
+    def __init__(self):
+        # r0, c0, r1, c1 of every slot
+        self.bounds = np.tile(np.array(self.EMPTY, dtype=np.int64), (64, 1))
+        self.cells: list[Cell | None] = []
+        self.slots: dict[Cell, int] = {}
+        self.free: list[int] = []
+
+    def add(self, cell: Cell, formula: Formula):
+        if self.free:
+            slot = self.free.pop()
+            self.cells[slot] = cell
+        else:
+            slot = len(self.cells)
+            self.cells.append(cell)
+            if slot == len(self.bounds):
+                grown = np.tile(np.array(self.EMPTY, dtype=np.int64), (len(self.bounds), 1))
+                self.bounds = np.concatenate([self.bounds, grown])
+        (r0, c0), (r1, c1) = formula.args
+        self.bounds[slot] = (r0, c0, r1, c1)
+        self.slots[cell] = slot
+
+    def remove(self, cell: Cell):
+        slot = self.slots.pop(cell)
+        self.bounds[slot] = self.EMPTY
+        self.cells[slot] = None
+        self.free.append(slot)
+
+    def readers(self, cell: Cell) -> list[Cell]:
+        """The cells whose range formula reads cell."""
+        if not self.slots:
+            return []
+        row, col = cell
+        bounds = self.bounds[:len(self.cells)]
+        inside = (bounds[:, 0] <= row) & (row <= bounds[:, 2]) & (bounds[:, 1] <= col) & (col <= bounds[:, 3])
+        return [self.cells[slot] for slot in np.flatnonzero(inside)]
+
+
+# What is summed for every value: the value, its square in 16-bit parts and
+# whether it is ERR. Split in halves, no sum of 32-bit squares over the whole
+# sheet overflows an int64.
+NUM_TERMS = 5
+VALUE, HI_HI, HI_LO, LO_LO, ERR = range(NUM_TERMS)
+
+
+def _terms(values: np.ndarray, errs: np.ndarray) -> np.ndarray:
+    hi, lo = values >> 16, values & 0xFFFF
+    return np.stack([values, hi * hi, hi * lo, lo * lo, errs.astype(np.int64)], axis=-1)
+
+
+def _cell_terms(value: int, err: bool) -> tuple[int, ...]:
+    hi, lo = value >> 16, value & 0xFFFF
+    return value, hi * hi, hi * lo, lo * lo, int(err)
+
+
+def _sum_squares(terms: np.ndarray) -> int:
+    return (int(terms[HI_HI]) << 32) + (int(terms[HI_LO]) << 17) + int(terms[LO_LO])
+
+
+class _Extrema:
+    """
+    Minimum and maximum of each of a grid of regions of the sheet, region(i, j)
+    being the values of region (i, j). Kept up to date on every write, except
+    for regions whose minimum or maximum was overwritten, those are
+    recomputed when they are read.
+    """
+
+    def __init__(self, shape: tuple[int, int], region: Callable[[int, int], np.ndarray]):
+        # A fresh sheet is all zeros
+        self.mins = np.zeros(shape, dtype=np.int64)
+        self.maxs = np.zeros(shape, dtype=np.int64)
+        self.stale = np.zeros(shape, dtype=bool)
+        self.region = region
+
+    def update(self, index: tuple[int, int], old: int, new: int):
+        if new > old == self.mins[index] or new < old == self.maxs[index]:
+            self.stale[index] = True
+        elif not self.stale[index]:
+            self.mins[index] = min(self.mins[index], new)
+            self.maxs[index] = max(self.maxs[index], new)
+
+    def read(self, i0: int, i1: int, j0: int, j1: int) -> tuple[int, int]:
+        """The minimum and maximum over regions [i0, i1) x [j0, j1)."""
+        for i, j in np.argwhere(self.stale[i0:i1, j0:j1]) + (i0, j0):
+            values = self.region(i, j)
+            self.mins[i, j], self.maxs[i, j] = values.min(), values.max()
+            self.stale[i, j] = False
+        return int(self.mins[i0:i1, j0:j1].min()), int(self.maxs[i0:i1, j0:j1].max())
+
+
+class RangeAggregates:
+    """
+    Answers range functions without reading every cell of the range. Rows
+    are grouped in bands of BLOCK rows and columns in segments of BLOCK
+    columns. On every write the sums of the terms (value, square, ERR) of
+    each column of a band and each segment of a row are updated, as well as
+    the minimum and maximum of each block (band x segment), column of a
+    band and segment of a row. Cumulative sums along every band and every
+    row are rebuilt lazily, for a band or row on the first range that reads
+    it after it changed.
+
+    The sums of a range take one lookup per band it covers entirely and per
+    row outside those, plus at most 2 * (BLOCK - 1) cells at the ends of
+    each such row. Its minimum and maximum read the blocks it covers, the
+    band columns and row segments at its edges and those cells.
+    """
+
+    BLOCK = 32
+
+    def __init__(self, values: np.ndarray, errs: np.ndarray):
+        self.values = values
+        self.errs = errs
+        block = self.BLOCK
+        num_rows, num_cols = values.shape
+        num_bands, num_segs = -(-num_rows // block), -(-num_cols // block)
+        # band_sums[b, c] sums column c of band b, seg_sums[r, s] segment s of row r
+        self.band_sums = np.zeros((num_bands, num_cols, NUM_TERMS), dtype=np.int64)
+        self.seg_sums = np.zeros((num_rows, num_segs, NUM_TERMS), dtype=np.int64)
+        # Their cumulative sums along bands and rows, band_prefix[b, c] sums
+        # band b left of column c; rebuilt where dirty is set
+        self.band_prefix = np.zeros((num_bands, num_cols + 1, NUM_TERMS), dtype=np.int64)
+        self.row_prefix = np.zeros((num_rows, num_segs + 1, NUM_TERMS), dtype=np.int64)
+        self.band_dirty = np.zeros(num_bands, dtype=bool)
+        self.row_dirty = np.zeros(num_rows, dtype=bool)
+
+        self.blocks = _Extrema(
+            (num_bands, num_segs),
+            lambda b, s: values[b * block:(b + 1) * block, s * block:(s + 1) * block],
+        )
+        self.band_cols = _Extrema((num_bands, num_cols), lambda b, c: values[b * block:(b + 1) * block, c])
+        self.row_segs = _Extrema((num_rows, num_segs), lambda r, s: values[r, s * block:(s + 1) * block])
+
+    def update(self, cell: Cell, old: int, old_err: bool):
+        """Accounts for the write of cell, which held old (ERR if old_err) before."""
+        row, col = cell
+        new, new_err = int(self.values[cell]), bool(self.errs[cell])
+        band, seg = row // self.BLOCK, col // self.BLOCK
+        delta = np.subtract(_cell_terms(new, new_err), _cell_terms(old, old_err))
+        self.band_sums[band, col] += delta
+        self.seg_sums[row, seg] += delta
+        self.band_dirty[band] = True
+        self.row_dirty[row] = True
+
+        self.blocks.update((band, seg), old, new)
+        self.band_cols.update((band, col), old, new)
+        self.row_segs.update((row, seg), old, new)
+
+    def _split(self, lo: int, hi: int) -> tuple[int, int, list[tuple[int, int]]]:
+        """
+        Splits the rows (or columns) [lo, hi) into the bands (or segments)
+        [g0, g1) entirely inside and the ranges around them.
+        """
+        block = self.BLOCK
+        g0, g1 = -(-lo // block), hi // block
+        if g0 >= g1:
+            return 0, 0, [(lo, hi)]
+        return g0, g1, [(a, b) for a, b in ((lo, g0 * block), (g1 * block, hi)) if a < b]
+
+    def _sums(self, r0: int, r1: int, c0: int, c1: int) -> np.ndarray:
+        """The sums of the terms over rows [r0, r1) and columns [c0, c1)."""
+        b0, b1, row_ranges = self._split(r0, r1)
+        total = np.zeros(NUM_TERMS, dtype=np.int64)
+        if b0 < b1:
+            bands = np.flatnonzero(self.band_dirty[b0:b1]) + b0
+            self.band_prefix[bands, 1:] = np.cumsum(self.band_sums[bands], axis=1)
+            self.band_dirty[bands] = False
+            total += (self.band_prefix[b0:b1, c1] - self.band_prefix[b0:b1, c0]).sum(axis=0)
+
+        s0, s1, col_ranges = self._split(c0, c1)
+        for ra, rb in row_ranges:
+            if s0 < s1:
+                rows = np.flatnonzero(self.row_dirty[ra:rb]) + ra
+                self.row_prefix[rows, 1:] = np.cumsum(self.seg_sums[rows], axis=1)
+                self.row_dirty[rows] = False
+                total += (self.row_prefix[ra:rb, s1] - self.row_prefix[ra:rb, s0]).sum(axis=0)
+            for ca, cb in col_ranges:
+                total += _terms(self.values[ra:rb, ca:cb], self.errs[ra:rb, ca:cb]).sum(axis=(0, 1))
+        return total
+
+    def _extrema(self, r0: int, r1: int, c0: int, c1: int) -> tuple[int, int]:
+        """The minimum and maximum over rows [r0, r1) and columns [c0, c1)."""
+        b0, b1, row_ranges = self._split(r0, r1)
+        s0, s1, col_ranges = self._split(c0, c1)
+        parts = []
+        if b0 < b1:
+            if s0 < s1:
+                parts.append(self.blocks.read(b0, b1, s0, s1))
+            parts += [self.band_cols.read(b0, b1, ca, cb) for ca, cb in col_ranges]
+        for ra, rb in row_ranges:
+            if s0 < s1:
+                parts.append(self.row_segs.read(ra, rb, s0, s1))
+            for ca, cb in col_ranges:
+                values = self.values[ra:rb, ca:cb]
+                parts.append((int(values.min()), int(values.max())))
+        return min(low for low, _ in parts), max(high for _, high in parts)
+
+    def query(self, op: str, start: Cell, end: Cell) -> int | None:
+        """The value of op over the range from start to end, None for ERR."""
+        (r0, c0), (r1, c1) = start, end
+        r1, c1 = r1 + 1, c1 + 1
+        sums = self._sums(r0, r1, c0, c1)
+        if sums[ERR]:
+            return None
+        if op in ("MIN", "MAX"):
+            low, high = self._extrema(r0, r1, c0, c1)
+            return low if op == "MIN" else high
+
+        count = (r1 - r0) * (c1 - c0)
+        total = int(sums[VALUE])
+        if op == "SUM":
+            return total
+        mean = _div(total, count)
+        if op == "AVG":
+            return mean
+        # The sum of (value - mean)^2, exactly
+        deviations = _sum_squares(sums) - 2 * mean * total + count * mean * mean
+        return int(round((deviations / count) ** 0.5))
+
+
+class Sheet:
+    """
+    The state of a running sheet: the values (ERR where errs is set), the
+    formula of every cell that has one and the viewport. Constants are
+    stored as values only.
+
+    The dependency graph is kept up to date on every assignment: dependents
+    maps a cell to the formulas referring to it directly, ranges holds the
+    range formulas. An assignment only visits and recomputes the cells that
+    depend on its target.
+    """
+
+    def __init__(self, num_rows: int, num_cols: int, refs: dict[str, Cell | None] | None = None):
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        # Parsed cell references, see parse_refs
+        self.refs = refs if refs is not None else {}
+        self.values = np.zeros((num_rows, num_cols), dtype=np.int64)
+        self.errs = np.zeros((num_rows, num_cols), dtype=bool)
+        self.formulas: dict[Cell, Formula] = {}
+        self.dependents: dict[Cell, set[Cell]] = {}
+        self.ranges = RangeIndex()
+        self.aggregates = RangeAggregates(self.values, self.errs)
+        self.top = 0
+        self.left = 0
+        self.output = True
+
+    def parse_cell(self, ref: str) -> Cell | None:
+        if ref not in self.refs:
+            # Not in the commands the references were parsed from
+            self.refs[ref] = parse_refs([ref]).get(ref)
+        cell = self.refs[ref]
+        if cell is None or not (cell[0] < self.num_rows and cell[1] < self.num_cols):
+            return None
+        return cell
+
+    def parse_operand(self, operand: str) -> Operand | None:
+        if operand[0].isdigit() or operand[0] == "-":
+            return int(operand)
+        return self.parse_cell(operand)
+
+    def parse_formula(self, expr: str) -> Formula | None:
+        if match := _VALUE_RE.fullmatch(expr):
+            operands, op = [match.group(1)], "="
+        elif match := _BINARY_RE.fullmatch(expr):
+            operands, op = [match.group(1), match.group(3)], match.group(2)
+        elif match := _SLEEP_RE.fullmatch(expr):
+            operands, op = [match.group(1)], "SLEEP"
+        elif match := _RANGE_RE.fullmatch(expr):
+            start, end = self.parse_cell(match.group(2)), self.parse_cell(match.group(3))
+            if start is None or end is None or start[0] > end[0] or start[1] > end[1]:
+                return None
+            return Formula(match.group(1), (start, end))
+        else:
+            return None
+        args = tuple(self.parse_operand(operand) for operand in operands)
+        if any(arg is None for arg in args):
+            return None
+        return Formula(op, args)
+
+    def _operand(self, operand: Operand) -> int | None:
+        if isinstance(operand, int):
+            return operand
+        return None if self.errs[operand] else int(self.values[operand])
+
+    def evaluate(self, formula: Formula) -> int | None:
+        """The value of formula on the current values, None for ERR."""
+        if formula.is_range:
+            return self.aggregates.query(formula.op, *formula.args)
+
+        args = [self._operand(arg) for arg in formula.args]
+        if any(arg is None for arg in args):
+            return None
+        if formula.op in ("=", "SLEEP"):
+            return args[0]
+        a, b = args
+        if formula.op == "+":
+            return a + b
+        if formula.op == "-":
+            return a - b
+        if formula.op == "*":
+            return a * b
+        if b == 0:
+            return None
+        return _div(a, b)
+
+    def _link(self, cell: Cell, formula: Formula):
+        if formula.is_range:
+            self.ranges.add(cell, formula)
+            return
+        for ref in formula.refs():
+            self.dependents.setdefault(ref, set()).add(cell)
+
+    def _unlink(self, cell: Cell, formula: Formula):
+        if formula.is_range:
+            self.ranges.remove(cell)
+            return
+        # B1+B1 reads B1 once
+        for ref in set(formula.refs()):
+            readers = self.dependents[ref]
+            readers.discard(cell)
+            if not readers:
+                del self.dependents[ref]
+
+    def dependents_of(self, cell: Cell) -> list[Cell]:
+        """The cells whose formula reads cell."""
+        return [*self.dependents.get(cell, ()), *self.ranges.readers(cell)]
+
+    def affected(self, target: Cell) -> list[Cell]:
+        """
+        target and every cell that depends on it, each after all the cells
+        it reads: the reverse postorder of a depth-first walk of dependents.
+        """
+        order = []
+        visited = {target}
+        stack = [(target, iter(self.dependents_of(target)))]
+        while stack:
+            cell, dependents = stack[-1]
+            for dependent in dependents:
+                if dependent not in visited:
+                    visited.add(dependent)
+                    stack.append((dependent, iter(self.dependents_of(dependent))))
+                    break
+            else:
+                stack.pop()
+                order.append(cell)
+        order.reverse()
+        return order
+
+    def _set(self, cell: Cell, value: int | None):
+        if value is not None and not INT_MIN <= value <= INT_MAX:
+            # What the sheet shows then depends on the implementation
+            raise OverflowError(f"{cell_name(*cell)} = {value} overflows an int")
+        old, old_err = int(self.values[cell]), bool(self.errs[cell])
+        self.errs[cell] = value is None
+        self.values[cell] = 0 if value is None else value
+        self.aggregates.update(cell, old, old_err)
+
+    def assign(self, target: Cell, formula: Formula) -> tuple[bool, int]:
+        """
+        Sets the formula of target and recomputes every cell that depends on
+        it. Returns whether it was accepted and the seconds spent sleeping,
+        every recomputed SLEEP sleeps again. The formula makes a cycle
+        exactly when it reads target or a cell that depends on target.
+        """
+        order = self.affected(target)
+        if any(formula.reads(cell) for cell in order):
+            return False, 0
+
+        old = self.formulas.pop(target, None)
+        if old is not None:
+            self._unlink(target, old)
+        if formula.op != "=" or formula.refs():
+            self.formulas[target] = formula
+            self._link(target, formula)
+        else:
+            self._set(target, formula.args[0])
+
+        seconds = 0
+        for cell in order:
+            current = self.formulas.get(cell)
+            if current is None:
+                continue
+            value = self.evaluate(current)
+            self._set(cell, value)
+            if current.op == "SLEEP" and value is not None and value > 0:
+                seconds += value
+        return True, seconds
+
+    def scroll(self, key: str):
+        max_top = max(self.num_rows - VIEWPORT, 0)
+        max_left = max(self.num_cols - VIEWPORT, 0)
+        if key == "w":
+            self.top = max(self.top - VIEWPORT, 0)
+        elif key == "s":
+            self.top = max(min(self.top + VIEWPORT, max_top), self.top)
+        elif key == "a":
+            self.left = max(self.left - VIEWPORT, 0)
+        elif key == "d":
+            self.left = max(min(self.left + VIEWPORT, max_left), self.left)
+
+    def run(self, command: str) -> tuple[bool, int]:
+        """Runs one command, returns whether it succeeded and the seconds it took."""
+        if command in ("w", "a", "s", "d"):
+            self.scroll(command)
+            return True, 0
+        if command in ("disable_output", "enable_output"):
+            self.output = command == "enable_output"
+            return True, 0
+        if command.startswith("scroll_to "):
+            cell = self.parse_cell(command[len("scroll_to "):])
+            if cell is None:
+                return False, 0
+            self.top, self.left = cell
+            return True, 0
+        match = _ASSIGN_RE.fullmatch(command)
+        if match is None:
+            return False, 0
+        target = self.parse_cell(match.group(1))
+        formula = self.parse_formula(match.group(2))
+        if target is None or formula is None:
+            return False, 0
+        return self.assign(target, formula)
+
+    def viewport(self) -> tuple[list[str], list[tuple[int, list[str]]]]:
+        """The column names and the (row number, cells) rows the sheet prints."""
+        rows = range(self.top, min(self.top + VIEWPORT, self.num_rows))
+        cols = range(self.left, min(self.left + VIEWPORT, self.num_cols))
+        table = []
+        for row in rows:
+            values = self.values[row, cols.start:cols.stop]
+            errs = self.errs[row, cols.start:cols.stop]
+            table.append((row + 1, ["ERR" if err else str(value) for value, err in zip(values, errs)]))
+        return list(COLUMN_NAMES[cols.start:cols.stop]), table
+
+
+def _div(a: int, b: int) -> int:
+    # C division, truncated towards zero
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+"""
+Parses the cell references in commands all at once (see parse_cells). Maps
+every word that looks like one to its cell, or to None if it isn't one.
+"""
+def parse_refs(commands: list[str]) -> dict[str, Cell | None]:
+    refs = sorted(set(_REF_RE.findall("\n".join(commands))))
+    rows, cols = parse_cells(refs)
+    return {
+        ref: (row, col) if row >= 0 else None
+        for ref, row, col in zip(refs, rows.tolist(), cols.tolist())
+    }
+
+
+"""
+Reads a .cmds file, returns the sheet size (from its header, if any) and the
+commands.
+"""
+def read_commands(cmd_file: Path) -> tuple[tuple[int, int], list[str]]:
+    with open(cmd_file) as f:
+        lines = f.read().splitlines()
+    header = lines[0].split() if lines else []
+    if len(header) == 2 and all(part.isdigit() for part in header):
+        return (int(header[0]), int(header[1])), lines[1:]
+    return DEFAULT_SHAPE, lines
+
+
+"""
+Runs the commands on a fresh sheet. Yields, for every command until q, its
+status, its time and the table printed after it (None with output disabled).
+"""
+def evaluate_commands(
+    shape: tuple[int, int], commands: list[str]
+) -> Iterator[tuple[bool, int, tuple[list[str], list] | None]]:
+    sheet = Sheet(*shape, parse_refs(commands))
+    for command in commands:
+        command = command.strip()
+        if command == "q":
+            return
+        ok, seconds = sheet.run(command)
+        yield ok, seconds, sheet.viewport() if sheet.output else None
+
+
+def format_table(table: tuple[list[str], list], header: bool = True) -> str:
+    names, rows = table
+    lines = ["\t" + "\t".join(names)] if header else []
+    lines += [f"{row}\t" + "\t".join(cells) for row, cells in rows]
+    return "\n".join(lines) + "\n"
+
+
+"""The .exp file of main.py: status, time and table of every command."""
+def expected_per_command(cmd_file: Path) -> str:
+    chunks = []
+    for ok, seconds, table in evaluate_commands(*read_commands(cmd_file)):
+        chunk = f"{'ok' if ok else 'err'} {seconds}\n"
+        if table is not None:
+            chunk += format_table(table)
+        chunks.append(chunk + CHUNK_SEPARATOR)
+    return "".join(chunks)
+
+
+"""The .exp file of main2.py/main3.py: the time budget and the last table printed."""
+def expected_final_table(cmd_file: Path, timeout: int) -> str:
+    last = None
+    for _, _, table in evaluate_commands(*read_commands(cmd_file)):
+        if table is not None:
+            last = table
+    return f"{timeout}\n" + (format_table(last, header=False) if last is not None else "")
+
+
+"""
+The .exp file of cmd_file for runner. main2 and main3 need the time budget,
+an .exp file without one would fail every submission.
+"""
+def expected_output(cmd_file: Path, runner: str, timeout: int | None = None) -> str:
+    if runner == "main":
+        return expected_per_command(cmd_file)
+    if timeout is None:
+        raise ValueError(f"The .exp file of {runner} needs a time budget")
+    return expected_final_table(cmd_file, timeout)
+
+
+"""Every .cmds file in test_dir (or test_dir itself, if it is a file)."""
+def find_cmds_files(test_dir: Path) -> list[Path]:
+    if test_dir.is_file():
+        return [test_dir]
+    return sorted(test_dir.rglob("*.cmds"))
+
+
+def _normalized(text: str) -> list[list[str]]:
+    return [line.split() for line in text.splitlines() if line.strip()]
+
+
+"""
+Compares the expected output of cmd_file with its .exp, whichever format that
+has. Returns the number of the first line that differs, or None.
+"""
+def check_test_case(cmd_file: Path, exp_file: Path) -> int | None:
+    with open(exp_file) as f:
+        existing = f.read()
+    first = existing.split("\n", 1)[0].split()
+    if len(first) == 1:
+        # The time budget isn't the oracle's to check
+        timeout = int(first[0])
+        produced = expected_final_table(cmd_file, timeout)
+    else:
+        produced = expected_per_command(cmd_file)
+    existing, produced = _normalized(existing), _normalized(produced)
+    for i, (a, b) in enumerate(zip(existing, produced)):
+        if a != b:
+            return i + 1
+    if len(existing) != len(produced):
+        return min(len(existing), len(produced)) + 1
+    return None
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ("main", "main2", "main3", "check"):
+        print("Usage: python oracle.py [main|main2|main3] [test_dir|file.cmds] [timeout]")
+        print("       python oracle.py check [test_dir|file.cmds]")
+        sys.exit(1)
+
+    mode = sys.argv[1]
+    if mode in ("main2", "main3") and len(sys.argv) < 4:
+        print(f"Usage: python oracle.py {mode} [test_dir|file.cmds] [timeout]")
+        print(f"       {mode} .exp files start with the time budget, timeout is required")
+        sys.exit(1)
+
+    if mode == "check":
+        test_cases = get_test_case_pairs(Path(sys.argv[2]))
+        failed = 0
+        for cmd, expected in test_cases:
+            line = check_test_case(cmd, expected)
+            if line is not None:
+                failed += 1
+                print(f"MISMATCH {expected} at line {line}")
+        print(f"{len(test_cases) - failed}/{len(test_cases)} match")
+        sys.exit(1 if failed else 0)
+
+    # Generated tests have no .exp file yet, write one for every .cmds file
+    timeout = int(sys.argv[3]) if mode != "main" else None
+    for cmd in find_cmds_files(Path(sys.argv[2])):
+        expected = cmd.with_suffix(".exp")
+        with open(expected, "w") as f:
+            f.write(expected_output(cmd, mode, timeout))
+        print(f"Wrote {expected}")
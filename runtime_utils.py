@@ -2,11 +2,24 @@
 This utilities are used for running the submission.
 """
 
+import atexit
 import dataclasses
+import errno
+import multiprocessing
 import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from typing import Literal, Optional
 import re
+import resource
+import select
+import signal
 import subprocess
+import sys
+import threading
+import time
+import warnings
+import numpy as np
 from rich.console import Console as RConsole
 from rich.text import Text as RText
 from rich.table import Table as RTable
@@ -17,7 +30,7 @@ from pathlib import Path
 import shutil
 import pandas as pd
 from dataclasses import dataclass
-from typing import Callable
+from typing import Callable, Iterator
 import zipfile
 from compile_utils import (
     find_makefile,
@@ -25,6 +38,7 @@ from compile_utils import (
     build_binary,
     get_test_case_pairs,
 )
+from journal import Journal, hash_inputs
 
 console = RConsole()
 # import pdb
@@ -47,11 +61,58 @@ class Diff:
     num_row_diff: tuple[int, int] | None = None
     # RowIdx, ExpectedValue, ObservedValue
     row_id_diff: tuple[int, int, int] | None = None
+    # RowIdx, ExpectedNumCells, ObservedNumCells
+    num_col_diff: tuple[int, int, int] | None = None
     # CellIdx, ExpectedValue, ObservedValue
     cell_value_diff: tuple[tuple[int, int], int | Err, int | Err] | None = None
+    # Number of cells that differ, cell_value_diff is the first of them
+    num_cell_diffs: int | None = None
     time_diff: tuple[str, int] | None = None
 
 
+@dataclasses.dataclass
+class Cells:
+    """
+    Cell values of a table as arrays, so that whole tables are compared in
+    one vectorized operation. Err cells hold 0 in values and are marked in
+    errs.
+    """
+
+    values: np.ndarray
+    errs: np.ndarray
+
+    @staticmethod
+    def from_rows(rows: list[list[int | Err]]) -> "Cells":
+        num_cols = len(rows[0]) if rows else 0
+        errs = np.array([[cell == "Err" for cell in row] for row in rows], dtype=bool)
+        values = np.array(
+            [[0 if cell == "Err" else cell for cell in row] for row in rows],
+            dtype=np.int64,
+        )
+        return Cells(values.reshape(len(rows), num_cols), errs.reshape(len(rows), num_cols))
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.values.shape
+
+    def cell(self, row: int, col: int) -> int | Err:
+        return "Err" if self.errs[row, col] else int(self.values[row, col])
+
+
+"""
+Compares two equally shaped Cells. Returns the first differing (row, col)
+in row-major order, None if the tables are equal, and the number of
+differing cells.
+"""
+def compare_cells(exp: Cells, got: Cells) -> tuple[tuple[int, int] | None, int]:
+    mismatch = (exp.values != got.values) | (exp.errs != got.errs)
+    num_diffs = int(np.count_nonzero(mismatch))
+    if num_diffs == 0:
+        return None, 0
+    row, col = np.unravel_index(np.argmax(mismatch), mismatch.shape)
+    return (int(row), int(col)), num_diffs
+
+
 @dataclasses.dataclass
 class Table:
     col_names: ColNames
@@ -86,6 +147,9 @@ class Table:
     def num_rows(self) -> int:
         return len(self.rows)
 
+    def cells(self) -> Cells:
+        return Cells.from_rows([row[1] for row in self.rows])
+
 
 @dataclasses.dataclass
 class ExpectedOutput:
@@ -119,14 +183,24 @@ def compute_diff(
     if exp_table.num_rows() != student_table.num_rows():
         return Diff(num_row_diff=(exp_table.num_rows(), student_table.num_rows()))
 
-    for row_idx, (my_row, other_row) in enumerate(
-        zip(exp_table.rows, student_table.rows)
-    ):
-        if my_row[0] != other_row[0]:
-            return Diff(row_id_diff=(row_idx, my_row[0], other_row[0]))
-        for cell_idx, (my_cell, other_cell) in enumerate(zip(my_row[1], other_row[1])):
-            if my_cell != other_cell:
-                return Diff(cell_value_diff=((row_idx, cell_idx), my_cell, other_cell))
+    exp_ids = np.array([row[0] for row in exp_table.rows])
+    student_ids = np.array([row[0] for row in student_table.rows])
+    if exp_ids.size and (exp_ids != student_ids).any():
+        row_idx = int(np.argmax(exp_ids != student_ids))
+        return Diff(row_id_diff=(row_idx, int(exp_ids[row_idx]), int(student_ids[row_idx])))
+
+    # Headers match, so a row with another number of cells is malformed
+    for row_idx, row in enumerate(student_table.rows):
+        if len(row[1]) != exp_table.num_cols():
+            return Diff(num_col_diff=(row_idx, exp_table.num_cols(), len(row[1])))
+
+    exp_cells, student_cells = exp_table.cells(), student_table.cells()
+    first, num_diffs = compare_cells(exp_cells, student_cells)
+    if first is not None:
+        return Diff(
+            cell_value_diff=(first, exp_cells.cell(*first), student_cells.cell(*first)),
+            num_cell_diffs=num_diffs,
+        )
 
     return None
 
@@ -209,6 +283,13 @@ def print_diff(
         text.append(f" found num rows {diff.row_id_diff[2]}", style="red")
         console.print(text)
 
+    elif diff.num_col_diff is not None:
+        text = RText()
+        text.append(f"{diff.num_col_diff[0]}th row", style="cyan")
+        text.append(f" is supposed to have {diff.num_col_diff[1]} cells,", style="green")
+        text.append(f" found {diff.num_col_diff[2]}", style="red")
+        console.print(text)
+
     elif diff.cell_value_diff is not None:
         table1, table2 = (
             get_rich_table(exp_sheet, (diff.cell_value_diff[0], "green")),
@@ -222,6 +303,8 @@ def print_diff(
             padding=(1, 2),
         )
         console.print(panel)
+        if diff.num_cell_diffs is not None and diff.num_cell_diffs > 1:
+            console.print(f"{diff.num_cell_diffs} cells differ")
     elif diff.time_diff is not None:
         text = RText()
         text.append("Command ")
@@ -232,6 +315,78 @@ def print_diff(
         console.print(text)
 
 
+_IS_WHITESPACE = np.zeros(256, dtype=bool)
+_IS_WHITESPACE[list(b" \t\n\r\v\f")] = True
+_INT64 = np.iinfo(np.int64)
+# Longest token that always fits an int64 (18 digits); numpy silently clamps
+# out of range tokens to the int64 bounds, so longer ones are parsed by int()
+_MAX_SAFE_TOKEN = 18
+
+
+def _int_or_err(token: str) -> tuple[int, bool]:
+    try:
+        value = int(token)
+    except ValueError:
+        return 0, True
+    if not _INT64.min <= value <= _INT64.max:
+        return 0, True
+    return value, False
+
+
+"""
+Parses whitespace separated table rows, each starting with its row index,
+into arrays in one pass. Err cells are found from the text (tokens starting
+with E), ERR/Err are then replaced by a 0 of the same length before the text
+is handed to numpy; any other token that isn't an int64 is an Err cell as
+well. Returns the row indices and the cells, or None if the rows do not all
+have the same number of cells.
+"""
+def parse_int_rows(lines: list[str]) -> tuple[np.ndarray, Cells] | None:
+    text = "\n".join(lines)
+
+    # Position and length of every token, and their number on every non-blank line
+    raw = np.frombuffer(text.encode(), dtype=np.uint8)
+    space = _IS_WHITESPACE[raw]
+    starts = ~space
+    starts[1:] &= space[:-1]
+    ends = ~space
+    ends[:-1] &= space[1:]
+    start_pos = np.flatnonzero(starts)
+    lengths = np.flatnonzero(ends) + 1 - start_pos
+    line_bounds = np.concatenate(([0], np.flatnonzero(raw == ord("\n")) + 1, [raw.size]))
+    counts = np.diff(np.searchsorted(start_pos, line_bounds))
+    counts = counts[counts > 0]
+    if len(counts) == 0:
+        return np.zeros(0, dtype=np.int64), Cells.from_rows([])
+    if (counts != counts[0]).any():
+        return None
+
+    values = None
+    if lengths.max() <= _MAX_SAFE_TOKEN:
+        # Any other token starting with E makes numpy stop below
+        errs = raw[start_pos] == ord("E")
+        try:
+            with warnings.catch_warnings():
+                # numpy warns (and will raise) when it stops at a non-integer token
+                warnings.simplefilter("error")
+                values = np.fromstring(
+                    text.replace("ERR", "0  ").replace("Err", "0  "), dtype=np.int64, sep=" "
+                )
+            if values.size != counts.sum():
+                values = None
+        except (DeprecationWarning, ValueError):
+            values = None
+    if values is None:
+        parsed = [_int_or_err(token) for token in text.split()]
+        values = np.array([value for value, _ in parsed], dtype=np.int64)
+        errs = np.array([err for _, err in parsed], dtype=bool)
+
+    values = values.reshape(len(counts), counts[0])
+    errs = errs.reshape(len(counts), counts[0])
+    assert not errs[:, 0].any(), f"Row index must be integer  {lines}"
+    return values[:, 0], Cells(np.where(errs[:, 1:], 0, values[:, 1:]), errs[:, 1:])
+
+
 """
 Parses list of string to Table.
 """
@@ -242,12 +397,18 @@ def parse_table(lines: list[str]) -> Table | None:
     header_line = lines[0].split()
     rows: list[tuple[int, list[int | Literal["Err"]]]] = []
 
-    # Parse row
+    parsed = parse_int_rows(lines[1:])
+    if parsed is not None:
+        row_ids, cells = parsed
+        for row_num, values, errs in zip(row_ids.tolist(), cells.values.tolist(), cells.errs.tolist()):
+            rows.append((row_num, ["Err" if err else value for value, err in zip(values, errs)]))
+        return Table(header_line, rows)
+
+    # Ragged rows, parse them one by one so that compute_diff can report them
     for row in lines[1:]:
-        if len(row) == 0:
-            continue
-        row = row.strip()
         cells = row.split()
+        if len(cells) == 0:
+            continue
         # First cell is row number
         assert cells[0].isnumeric(), f"Row index must be integer  {lines}"
         row_num = int(cells[0])
@@ -255,7 +416,6 @@ def parse_table(lines: list[str]) -> Table | None:
         # Parse cell to integer or Err
         parsed_cells: list[int | Literal["Err"]] = []
         for cell in cells[1:]:
-            cell = cell.strip()
             try:
                 parsed_cells.append(int(cell))
             except ValueError:
@@ -265,10 +425,257 @@ def parse_table(lines: list[str]) -> Table | None:
     return Table(header_line, rows)
 
 
-def extract_zip(file: Path) -> Path | None:
+class Workspace:
+    """
+    Scratch tree for one grading run. Extracted sources, the built binary and
+    the files of every test live under a unique directory, so any number of
+    graders can share a host. The tree is removed on cleanup, or at exit for
+    workspaces that were never cleaned up. A workspace can be handed to a
+    worker process, only the process that created it removes it at exit.
+    """
+
+    _live: set["Workspace"] = set()
+
+    def __init__(self, prefix: str = "cop290_"):
+        self.root = Path(tempfile.mkdtemp(prefix=prefix))
+        self._num_tests = 0
+        Workspace._live.add(self)
+
+    @property
+    def extract_dir(self) -> Path:
+        return self.root / "src"
+
+    @property
+    def build_dir(self) -> Path:
+        return self.root / "build"
+
+    def test_dir(self, cmd_file: Path) -> Path:
+        """Returns a fresh scratch directory for a single test run."""
+        self._num_tests += 1
+        path = self.root / "tests" / f"{self._num_tests}_{Path(cmd_file).stem}"
+        path.mkdir(parents=True)
+        return path
+
+    def cleanup(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+        Workspace._live.discard(self)
+
+    def __enter__(self) -> "Workspace":
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+
+@atexit.register
+def _cleanup_workspaces():
+    for workspace in list(Workspace._live):
+        workspace.cleanup()
+
+
+def kill_process_group(pgid: int):
+    """
+    Kills every process in the group a runner spawned for one test. The
+    runners start the binary as a session leader, so this reaps the binary
+    and its children without touching processes of other graders.
+    """
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _wait_exit(pid: int, timeout: float) -> bool:
+    """Sleeps until pid exits (leaving it unreaped) or timeout expires."""
+    try:
+        pidfd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        # No pidfd on this platform/kernel, block in a waiter thread instead.
+        def wait():
+            try:
+                os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+            except ChildProcessError:
+                pass
+
+        waiter = threading.Thread(target=wait, daemon=True)
+        waiter.start()
+        waiter.join(timeout)
+        return not waiter.is_alive()
+
+    try:
+        poller = select.poll()
+        poller.register(pidfd, select.POLLIN)
+        return len(poller.poll(timeout * 1000)) > 0
+    finally:
+        os.close(pidfd)
+
+
+def supervise(process: subprocess.Popen, timeout: float) -> tuple[bool, float, resource.struct_rusage]:
+    """
+    Waits for process to exit without polling, so the grader sleeps while
+    the binary runs. If it is still running after timeout seconds its process
+    group is killed. The process is reaped with wait4, and this returns
+    (timed_out, wall time in seconds, rusage of the process).
+    """
+    start = time.monotonic()
+    timed_out = not _wait_exit(process.pid, timeout)
+    time_taken = time.monotonic() - start
+    if timed_out:
+        kill_process_group(process.pid)
+
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return timed_out, time_taken, rusage
+
+
+def max_rss_mb(maxrss: int) -> float:
+    """ru_maxrss in MiB."""
+    # ru_maxrss is in bytes on macOS and KiB everywhere else
+    if sys.platform == "darwin":
+        return maxrss / 2**20
+    return maxrss / 2**10
+
+
+# A cgroup v2 directory the grader may create child cgroups under, e.g. the
+# cgroup of a `systemd-run --user -p Delegate=yes` unit with the memory
+# controller enabled in its cgroup.subtree_control. Unset on most machines.
+CGROUP_PARENT = os.environ.get("COP290_CGROUP_PARENT")
+
+# Runs a command and reports its ru_maxrss, see maxrss.py
+MAXRSS_HELPER = Path(__file__).with_name("maxrss.py")
+
+
+class MemoryProbe:
+    """
+    Starts the process tree of one test and measures its peak resident
+    memory (MiB).
+
+    With CGROUP_PARENT set every test runs in a fresh child cgroup and the
+    peak is read from its memory.peak, which only counts pages the tree
+    itself touched; max_mb is then enforced through memory.max. Otherwise
+    the command is started through maxrss.py, which reports the ru_maxrss of
+    the command and every descendant it reaped. Forked from that small
+    process rather than from the grader, the reading doesn't include the
+    grader's own resident pages.
+    """
+
+    def __init__(self, max_mb: int | None = None):
+        self.cgroup: Path | None = None
+        # Read end of the pipe maxrss.py reports on
+        self._report: int | None = None
+        if CGROUP_PARENT:
+            self.cgroup = Path(tempfile.mkdtemp(prefix="cop290_", dir=CGROUP_PARENT))
+            if max_mb is not None:
+                (self.cgroup / "memory.max").write_text(f"{max_mb}M")
+
+    @property
+    def limits_memory(self) -> bool:
+        return self.cgroup is not None
+
+    def _enter_cgroup(self):
+        # Popen preexec_fn, moves the child into the cgroup before exec
+        with open(self.cgroup / "cgroup.procs", "w") as f:
+            f.write("0")
+
+    def popen(self, cmd: list[str], **kwargs) -> subprocess.Popen:
+        """Starts cmd like subprocess.Popen(cmd, **kwargs), measured by this probe."""
+        if self.cgroup is not None:
+            return subprocess.Popen(cmd, preexec_fn=self._enter_cgroup, **kwargs)
+
+        # The helper always starts, fail like Popen would for a missing binary
+        if shutil.which(cmd[0]) is None:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), cmd[0])
+        read_fd, write_fd = os.pipe()
+        try:
+            process = subprocess.Popen(
+                [sys.executable, "-I", "-S", str(MAXRSS_HELPER), str(write_fd), *cmd],
+                pass_fds=(write_fd,),
+                **kwargs,
+            )
+        except BaseException:
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
+        self._report = read_fd
+        return process
+
+    def peak_mb(self) -> float:
+        """
+        The peak of the process that popen started, once it was reaped.
+        -1 if it is unknown: the helper was killed (on a timeout) before the
+        command exited.
+        """
+        if self.cgroup is not None:
+            return int((self.cgroup / "memory.peak").read_text()) / 2**20
+        if self._report is None:
+            return -1
+        with open(self._report, closefd=False) as f:
+            report = f.read().strip()
+        return max_rss_mb(int(report)) if report else -1
+
+    def oom_killed(self) -> bool:
+        if self.cgroup is None:
+            return False
+        for line in (self.cgroup / "memory.events").read_text().splitlines():
+            key, value = line.split()
+            if key == "oom_kill":
+                return int(value) > 0
+        return False
+
+    def close(self):
+        if self._report is not None:
+            os.close(self._report)
+            self._report = None
+        if self.cgroup is None:
+            return
+        # The group was killed and reaped, but the kernel may take a moment
+        # to release the cgroup of its last members.
+        for _ in range(100):
+            try:
+                self.cgroup.rmdir()
+                break
+            except OSError:
+                time.sleep(0.01)
+        self.cgroup = None
+
+    def __enter__(self) -> "MemoryProbe":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_lines_reversed(path: Path, block_size: int = 1 << 16) -> Iterator[str]:
+    """
+    Yields the lines of a file from last to first (without line endings) by
+    reading it backwards in blocks, so only the tail that is consumed is ever
+    read. Lines are the ones readlines() would return.
+    """
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        if pos == 0:
+            return
+        f.seek(pos - 1)
+        if f.read(1) == b"\n":
+            pos -= 1
+
+        partial = b""
+        while pos > 0:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            lines = (f.read(step) + partial).split(b"\n")
+            # The first piece may continue in the previous block
+            partial = lines.pop(0)
+            for line in reversed(lines):
+                yield line.decode(errors="replace")
+        yield partial.decode(errors="replace")
+
+
+def extract_zip(file: Path, extract_to: Path) -> Path | None:
     if file.suffix != ".zip":
         return None
-    extract_to = Path("/tmp/cop290_lab1/")
     # Remove the extract_to directory if it exists
     if extract_to.exists():
         shutil.rmtree(extract_to)
@@ -296,20 +703,61 @@ class TestResult:
     is_pass: bool
     marks: float
     time_taken_s: int = -1
+    # Peak resident memory of the test's process tree in MiB, see MemoryProbe
     max_mem_gb: int = -1
     reason: str = ""
 
 
-def eval_single(
-    test_lambda: Callable[[Path, Path, Path, dict[str, int]], TestResult],
+# (bin_path, cmd_file, exp_file, marks_mapping, scratch_dir) -> TestResult
+type TestLambda = Callable[[Path, Path, Path, dict[str, int], Path], TestResult]
+
+
+"""The patch file of a group, if any of its members has one."""
+def find_patch_file(entry_nos: list[str]) -> Path | None:
+    patch_path = None
+    for entry_no in entry_nos:
+        patch_file = extract_patch_file_path(entry_no) 
+        if patch_file:
+            if patch_path:
+                assert patch_file == patch_file, f"Two different patch file found {patch_file} {patch_path}"
+            else:
+                patch_path = patch_file
+    return patch_path
+
+
+"""
+Hashes of what the result of every test depends on: its .cmds and .exp files
+and its rows of the marks mapping. Keyed like the journal, by str(cmd).
+"""
+def test_input_hashes(test_cases: list[tuple[Path, Path]], marks_mapping: dict[str, dict]) -> dict[str, str]:
+    hashes = {}
+    for cmd, expected in test_cases:
+        mapping = tuple(f"{column}={values.get(str(cmd))}" for column, values in sorted(marks_mapping.items()))
+        hashes[str(cmd)] = hash_inputs(cmd, expected, extra=mapping)
+    return hashes
+
+
+"""Hash of what grading a submission depends on: the zip and the patch applied to it."""
+def submission_input_hash(submission_zip: Path, entry_nos: list[str], patch: bool = False) -> str:
+    return hash_inputs(submission_zip, find_patch_file(entry_nos) if patch else None)
+
+
+"""The inputs of every (submission, test) result, as recorded in the journal."""
+def cell_inputs(submission_hash: str, test_hashes: dict[str, str]) -> dict[str, str]:
+    return {test: f"{submission_hash}:{test_hash}" for test, test_hash in test_hashes.items()}
+
+
+"""
+Extracts a submission into workspace, applies its patch and builds it.
+Returns the path to the binary, or the reason it couldn't be built.
+"""
+def prepare_submission(
     submission_zip: Path,
-    test_dir: Path,
     entry_nos: list[str],
-    marks_mapping: dict[str, int],
+    workspace: Workspace,
     patch: bool = False,
-    add_mem_info: bool = False,
-):
-    extraction = extract_zip(submission_zip)
+) -> Path | str:
+    extraction = extract_zip(submission_zip, workspace.extract_dir)
     if extraction is None:
         return "Couldn't extract zip file"
     else:
@@ -319,44 +767,65 @@ def eval_single(
     if make_file_dir is None:
         return "Makefile not found"
 
-    if patch:
-        # find the patch file
-        patch_path = None
-        for entry_no in entry_nos:
-            patch_file = extract_patch_file_path(entry_no) 
-            if patch_file:
-                if patch_path:
-                    assert patch_file == patch_file, f"Two different patch file found {patch_file} {patch_path}"
-                else:
-                    patch_path = patch_file
-        if patch_path:
-            print(patch_path)
-            print("Applying patch")
-            subprocess.run(["git", "apply", str(patch_path)], cwd=str(make_file_dir))
+    patch_path = find_patch_file(entry_nos) if patch else None
+    if patch_path:
+        print(patch_path)
+        print("Applying patch")
+        subprocess.run(["git", "apply", str(patch_path)], cwd=str(make_file_dir))
 
     try:
-        bin_path = build_binary(make_file_dir, entry_nos)
+        return build_binary(make_file_dir, entry_nos, workspace.build_dir, patch_path)
     except FileNotFoundError:
         return "Couldn't compile binary"
 
+
+"""Adds the result of one test to the marks of a submission, as they go in the csv."""
+def add_marks(marks: dict, cmd: Path, result: TestResult, add_mem_info: bool = False):
+    if not result.is_pass:
+        marks[str(cmd)] = result.reason
+    else:
+        marks[str(cmd)] = result.marks
+    if add_mem_info and result.max_mem_gb != -1:
+        marks[f"{str(cmd)}_mem"] = result.max_mem_gb
+        marks[f"{str(cmd)}_time"] = result.time_taken_s
+
+
+"""
+Runs every test in test_dir against a built binary, prints the verdicts and
+returns the marks of each test. With a journal, tests that already have a
+result for this submission are not run again and new results are recorded.
+inputs maps every test to the hash of its inputs (see cell_inputs), then a
+recorded result only counts if it was graded with the same inputs.
+"""
+def run_tests(
+    test_lambda: TestLambda,
+    bin_path: Path,
+    test_dir: Path,
+    marks_mapping: dict[str, int],
+    workspace: Workspace,
+    add_mem_info: bool = False,
+    journal: Journal | None = None,
+    submission: str = "",
+    inputs: dict[str, str] | None = None,
+) -> dict:
     test_cases = get_test_case_pairs(test_dir)
+    inputs = inputs or {}
 
     verdict = []
     marks = {}
     for cmd, expected in test_cases:
-        console.print(f"Running {cmd}")
-        result = test_lambda(bin_path, cmd, expected, marks_mapping)
-        # Kill spreadsheet process for sanity
-        subprocess.run(["pkill", "-f", "sheet"])
+        cmd_inputs = inputs.get(str(cmd))
+        recorded = journal.get(submission, str(cmd), cmd_inputs) if journal is not None else None
+        if recorded is not None:
+            result = TestResult(**recorded)
+        else:
+            console.print(f"Running {cmd}")
+            result = test_lambda(bin_path, cmd, expected, marks_mapping, workspace.test_dir(cmd))
+            if journal is not None:
+                journal.record(submission, str(cmd), dataclasses.asdict(result), cmd_inputs or "")
 
         verdict.append((cmd, result.is_pass, result.reason, result.marks, result.max_mem_gb, result.time_taken_s))
-        if not result.is_pass:
-            marks[str(cmd)] = result.reason
-        else:
-            marks[str(cmd)] = result.marks
-        if add_mem_info and result.max_mem_gb != -1:
-            marks[f"{str(cmd)}_mem"] = result.max_mem_gb
-            marks[f"{str(cmd)}_time"] = result.time_taken_s
+        add_marks(marks, cmd, result, add_mem_info)
 
     table = RTable()
 
@@ -375,23 +844,227 @@ def eval_single(
     return marks
 
 
+def eval_single(
+    test_lambda: TestLambda,
+    submission_zip: Path,
+    test_dir: Path,
+    entry_nos: list[str],
+    marks_mapping: dict[str, int],
+    patch: bool = False,
+    add_mem_info: bool = False,
+    journal: Journal | None = None,
+    inputs: dict[str, str] | None = None,
+):
+    with Workspace() as workspace:
+        bin_path = prepare_submission(submission_zip, entry_nos, workspace, patch)
+        if isinstance(bin_path, str):
+            return bin_path
+        return run_tests(
+            test_lambda, bin_path, test_dir, marks_mapping, workspace, add_mem_info, journal, submission_zip.name,
+            inputs,
+        )
+
+
+"""
+The marks of a submission as recorded in the journal, in test order: the
+reason it couldn't be graded, or the marks of every test with a result.
+"""
+def journal_marks(
+    journal: Journal, submission: str, test_cases: list[tuple[Path, Path]], add_mem_info: bool = False
+) -> dict | str:
+    error = journal.error(submission)
+    if error is not None:
+        return error
+    marks = {}
+    for cmd, _ in test_cases:
+        recorded = journal.get(submission, str(cmd))
+        if recorded is not None:
+            add_marks(marks, cmd, TestResult(**recorded), add_mem_info)
+    return marks
+
+
+def _passed(result: dict) -> bool:
+    return result.get("is_pass", False)
+
+
+def is_number(s: str) -> bool:
+    try:
+        float(s)
+        return True
+    except ValueError:
+        return False
+
+
+"""
+Rows for the marks csv of one submission, one per entry number. result is
+either the marks of every test or the reason the submission failed, failed
+submissions are copied to failed_dir.
+"""
+def submission_rows(
+    submission_zip: Path,
+    entry_nos: list[str],
+    result: dict | str,
+    failed_dir: Path,
+) -> list[dict]:
+    total_data = []
+    group_idx = "_".join(entry_nos)
+    if isinstance(result, str):
+        for e in entry_nos:
+            data = {}
+            data["group_idx"] = group_idx
+            data["entry_no"] = e
+            data["error"] = result
+            data["total"] = 0
+            total_data.append(data)
+        failed_dir.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(submission_zip, failed_dir / submission_zip.name)
+    else:
+        for e in entry_nos:
+            data = {}
+            data["group_idx"] = group_idx
+            data["entry_no"] = e
+            data["error"] = None
+            data |= result
+            total = 0
+            for k, v in result.items():
+                if k.endswith(".cmds") and is_number(v):
+                    total += v
+            data["total"] = total
+            total_data.append(data)
+    return total_data
+
+
+"""
+Grades one submission zip into the journal, unless the journal already has
+its results for the current zip, patch and tests. test_hashes are the
+test_input_hashes of test_dir. Runs inside a batch worker process.
+"""
+def eval_submission(
+    test_lambda: TestLambda,
+    submission_zip: Path,
+    test_dir: Path,
+    marks_mapping: dict[str, int],
+    journal: Journal,
+    test_hashes: dict[str, str],
+    add_mem_info: bool = False,
+    patch: bool = False,
+):
+    entry_nos = extract_entry_no(submission_zip)
+    if not entry_nos:
+        return
+    submission_hash = submission_input_hash(submission_zip, entry_nos, patch)
+    inputs = cell_inputs(submission_hash, test_hashes)
+    if journal.is_done(submission_zip.name, inputs, submission_hash):
+        return
+
+    print(f"Evaluating: {submission_zip}")
+    try:
+        result = eval_single(
+            test_lambda,
+            submission_zip,
+            test_dir,
+            entry_nos,
+            marks_mapping,
+            patch,
+            add_mem_info,
+            journal,
+            inputs,
+        )
+    except Exception as e:
+        result = str(e)
+    if isinstance(result, str):
+        journal.record_error(submission_zip.name, result, submission_hash)
+
+
+"""
+Grades submissions into the journal in two overlapping stages. A pool of
+builder threads extracts, patches and builds (the work happens in make), and
+every binary that is ready goes straight to a pool of test runner processes.
+The runners are started by a forkserver: forked from this process they would
+inherit the pipes of make processes the builders are starting, and those
+builders would wait on the pipes forever.
+"""
+def eval_pipelined(
+    test_lambda: TestLambda,
+    submissions: list[Path],
+    test_dir: Path,
+    marks_mapping: dict[str, int],
+    journal: Journal,
+    test_hashes: dict[str, str],
+    add_mem_info: bool,
+    patch: bool,
+    num_builders: int,
+    num_workers: int,
+):
+    with ThreadPoolExecutor(max_workers=max(num_builders, 1)) as builders, \
+            ProcessPoolExecutor(
+                max_workers=max(num_workers, 1), mp_context=multiprocessing.get_context("forkserver")
+            ) as runners:
+        builds = {}
+        for submission_zip in submissions:
+            entry_nos = extract_entry_no(submission_zip)
+            if not entry_nos:
+                continue
+            submission_hash = submission_input_hash(submission_zip, entry_nos, patch)
+            if journal.is_done(submission_zip.name, cell_inputs(submission_hash, test_hashes), submission_hash):
+                continue
+            print(f"Evaluating: {submission_zip}")
+            workspace = Workspace()
+            future = builders.submit(prepare_submission, submission_zip, entry_nos, workspace, patch)
+            builds[future] = (submission_zip, submission_hash, workspace)
+
+        runs = {}
+        for future in as_completed(builds):
+            submission_zip, submission_hash, workspace = builds[future]
+            try:
+                bin_path = future.result()
+            except Exception as e:
+                bin_path = str(e)
+            if isinstance(bin_path, str):
+                journal.record_error(submission_zip.name, bin_path, submission_hash)
+                workspace.cleanup()
+                continue
+            future = runners.submit(
+                run_tests, test_lambda, bin_path, test_dir, marks_mapping, workspace, add_mem_info,
+                journal, submission_zip.name, cell_inputs(submission_hash, test_hashes),
+            )
+            runs[future] = (submission_zip, submission_hash, workspace)
+
+        for future in as_completed(runs):
+            submission_zip, submission_hash, workspace = runs[future]
+            try:
+                future.result()
+            except Exception as e:
+                journal.record_error(submission_zip.name, str(e), submission_hash)
+            workspace.cleanup()
+
+
 def eval_batch(
-    test_lambda: Callable[[Path, Path, Path, dict[str, int]], TestResult],
+    test_lambda: TestLambda,
     submission_dir: Path,
     test_dir: Path,
     marks_mapping: dict[str, int],
     marks_csv: Path,
     add_mem_info: bool = False,
-    patch: bool = False
+    patch: bool = False,
+    num_workers: int = 1,
+    num_builders: int | None = None,
+    resume: bool = False,
+    retry_failed: bool = False,
 ):
-    def is_number(s: str) -> bool:
-        try:
-            float(s)
-            return True
-        except ValueError:
-            return False
-
-    total_data = []
+    """
+    Grades every zip in submission_dir. With more than one worker, builds run
+    on num_builders threads (num_workers by default) while binaries that are
+    already built are tested by num_workers processes. Runners that share a
+    core slow each other down and the time limits would depend on the worker
+    count, so num_workers is cut to the cores the builders leave free.
+
+    Every result goes to a journal next to marks_csv as soon as it is known
+    and the csv is written from the journal, in submission order. resume
+    skips whatever the journal of an earlier run has, unless the zip, its
+    patch, the test or its marks changed since; then only those results are
+    graded again. retry_failed also re-runs failed tests and submissions.
+    """
     # Add the failed submissions to this directory for manual inspection
     failed_dir = Path("/tmp/cop290_lab1_failed/")
 
@@ -399,95 +1072,71 @@ def eval_batch(
         shutil.rmtree(failed_dir)
         failed_dir.mkdir(parents=True, exist_ok=True)
 
-    i = 0
-    for submission_zip in submission_dir.iterdir():
-        i += 1
-        # if i > 10:
-        #     continue
+    submissions = list(submission_dir.iterdir())
+    journal = Journal(
+        Path(marks_csv).expanduser().with_suffix(".jsonl"),
+        resume=resume or retry_failed,
+        keep=_passed if retry_failed else None,
+    )
+    test_cases = get_test_case_pairs(test_dir)
+    args = (test_dir, marks_mapping, journal, test_input_hashes(test_cases, marks_mapping), add_mem_info, patch)
+    if num_builders is None:
+        num_builders = num_workers
+    if num_workers > 1 or num_builders > 1:
+        free_cores = max((os.cpu_count() or 1) - num_builders, 1)
+        if num_workers > free_cores:
+            console.print(
+                f"[yellow]{num_workers} test runners and {num_builders} builders on {os.cpu_count()} cores, "
+                f"running {free_cores} test runners so that timings hold[/yellow]"
+            )
+            num_workers = free_cores
 
-        print(f"Evaluating: {submission_zip}")
-        try:
-            entry_nos = extract_entry_no(submission_zip)
-            if not entry_nos:
-                data = {}
-                data["group_idx"] = submission_zip.stem
-                data["entry_no"] = None
-                data["error"] = f"Couldn't extract entry numbers from {submission_zip}"
-                data["total"] = 0
-                failed_dir.mkdir(parents=True, exist_ok=True)
-                shutil.copyfile(submission_zip, failed_dir / submission_zip.name)
-                continue
+    if num_workers <= 1 and num_builders <= 1:
+        for submission_zip in submissions:
+            eval_submission(test_lambda, submission_zip, *args)
+    else:
+        eval_pipelined(test_lambda, submissions, *args, num_builders, num_workers)
 
-            group_idx = "_".join(entry_nos)
-            result = eval_single(
-                test_lambda,
-                submission_zip,
-                test_dir,
-                entry_nos,
-                marks_mapping,
-                patch,
-                add_mem_info,
-            )
-            if isinstance(result, str):
-                data = {}
-                data["group_idx"] = submission_zip.stem
-                for e in entry_nos:
-                    data = {}
-                    data["group_idx"] = group_idx
-                    data["entry_no"] = e
-                    data["error"] = result
-                    data["total"] = 0
-                    total_data.append(data)
-                failed_dir.mkdir(parents=True, exist_ok=True)
-                shutil.copyfile(submission_zip, failed_dir / submission_zip.name)
-            else:
-                for e in entry_nos:
-                    data = {}
-                    data["group_idx"] = group_idx
-                    data["entry_no"] = e
-                    data["error"] = None
-                    data |= result
-                    total = 0
-                    for k, v in result.items():
-                        if k.endswith(".cmds") and is_number(v):
-                            total += v
-                    data["total"] = total
-                    total_data.append(data)
-
-        except Exception as e:
-            for en in entry_nos:
-                data = {}
-                data["group_idx"] = group_idx
-                data["entry_no"] = en
-                data["error"] = str(e)
-                data["total"] = 0
-                failed_dir.mkdir(parents=True, exist_ok=True)
-                shutil.copyfile(submission_zip, failed_dir / submission_zip.name)
-                total_data.append(data)
+    # Workers appended to the journal file, read back everything it holds now
+    journal = Journal(journal.path, resume=True)
+    total_data = []
+    for submission_zip in submissions:
+        entry_nos = extract_entry_no(submission_zip)
+        if not entry_nos:
+            failed_dir.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(submission_zip, failed_dir / submission_zip.name)
+            continue
+        result = journal_marks(journal, submission_zip.name, test_cases, add_mem_info)
+        total_data += submission_rows(submission_zip, entry_nos, result, failed_dir)
 
     df = pd.DataFrame(total_data)
     df.to_csv(str(marks_csv), index=False)
 
 
 def eval_batch_binary(
-    test_lambda: Callable[[Path, Path, Path, dict[str, int]], TestResult],
+    test_lambda: TestLambda,
     submissions_dir: Path,
     test_dir: Path,
     marks_mapping: dict[str, int],
     marks_csv: Path,
+    resume: bool = False,
+    retry_failed: bool = False,
 ):
-    """Grade a directory of already-extracted submissions, each with a pre-built 'sheet' binary."""
-
-    def is_number(s: str) -> bool:
-        try:
-            float(s)
-            return True
-        except ValueError:
-            return False
+    """
+    Grade a directory of already-extracted submissions, each with a pre-built 'sheet' binary.
+    Results are journaled like in eval_batch, resume skips the tests the journal has
+    for the same binary and test inputs.
+    """
 
-    total_data = []
     test_cases = get_test_case_pairs(test_dir)
-
+    journal = Journal(
+        Path(marks_csv).expanduser().with_suffix(".jsonl"),
+        resume=resume or retry_failed,
+        keep=_passed if retry_failed else None,
+    )
+    test_hashes = test_input_hashes(test_cases, marks_mapping)
+
+    graded = []
     for student_dir in sorted(submissions_dir.iterdir()):
         if not student_dir.is_dir():
             continue
@@ -498,19 +1147,21 @@ def eval_batch_binary(
             continue
 
         console.print(f"\n[cyan]Evaluating: {student_dir.name}[/cyan]")
-        result_map = {}
+        inputs = cell_inputs(hash_inputs(bin_path), test_hashes)
 
-        for cmd, expected in test_cases:
-            console.print(f"  Running {cmd.name}")
-            result = test_lambda(bin_path, cmd, expected, marks_mapping)
-            subprocess.run(["pkill", "-f", "sheet"])
+        with Workspace() as workspace:
+            for cmd, expected in test_cases:
+                if journal.get(student_dir.name, str(cmd), inputs[str(cmd)]) is None:
+                    console.print(f"  Running {cmd.name}")
+                    result = test_lambda(bin_path, cmd, expected, marks_mapping, workspace.test_dir(cmd))
+                    journal.record(student_dir.name, str(cmd), dataclasses.asdict(result), inputs[str(cmd)])
+        graded.append(student_dir)
 
-            if result.is_pass:
-                result_map[str(cmd)] = result.marks
-            else:
-                result_map[str(cmd)] = result.reason
-
-        total = sum(v for v in result_map.values() if is_number(str(v)))
+    # The csv comes from the journal, like in eval_batch
+    total_data = []
+    for student_dir in graded:
+        marks = journal_marks(journal, student_dir.name, test_cases)
+        total = sum(v for v in marks.values() if is_number(str(v)))
 
         # One row per entry number encoded in the directory name
         entry_no_regex = r"20\d{2}\w{2,3}\d{4,5}"
@@ -520,7 +1171,7 @@ def eval_batch_binary(
 
         for entry_no in entry_nos:
             data = {"group_idx": student_dir.name, "entry_no": entry_no, "total": total}
-            data |= result_map
+            data |= marks
             total_data.append(data)
 
     df = pd.DataFrame(total_data)
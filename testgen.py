@@ -0,0 +1,296 @@
+"""
+    Shared pieces of the test case generators. Column names come from the
+    tables in columns.py, commands are written in large joined chunks
+    instead of one write per command, and every generator is a plain
+    iterator of commands, so each can be written (and given its expected
+    output by oracle.py) from one CLI:
+
+        python testgen.py --exp main2 --timeout 50 dense_dag out.cmds 20000 MAX 1
+"""
+import argparse
+import random
+import sys
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from columns import COLUMN_NAMES, NUM_COLS
+
+NUM_ROWS = 999
+
+
+class CommandWriter:
+    """
+    Writes commands to a .cmds file, one per line. Commands are collected
+    and written chunk_lines at a time as one joined string; the file is
+    closed (and flushed) on exit.
+    """
+
+    def __init__(self, path: Path, header: tuple[int, int] | None = None, chunk_lines: int = 1 << 16):
+        self.file = open(path, "w", buffering=1 << 20)
+        self.chunk_lines = chunk_lines
+        self.pending: list[str] = []
+        self.num_commands = 0
+        if header is not None:
+            self.file.write(f"{header[0]} {header[1]}\n")
+
+    def write(self, command: str):
+        self.pending.append(command)
+        if len(self.pending) >= self.chunk_lines:
+            self.flush()
+
+    def write_all(self, commands: Iterable[str]):
+        for command in commands:
+            self.write(command)
+
+    def flush(self):
+        if self.pending:
+            self.file.write("\n".join(self.pending) + "\n")
+            self.num_commands += len(self.pending)
+            self.pending = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self) -> "CommandWriter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_commands(path: Path, commands: Iterable[str], header: tuple[int, int] | None = None) -> int:
+    """Writes commands to path, returns how many there were."""
+    with CommandWriter(path, header) as writer:
+        writer.write_all(commands)
+    return writer.num_commands
+
+
+# The generators. Columns are 1-based, like in the scripts they come from.
+
+
+def dense_dag(max_num_edges: int, operation: str, add_reassign: bool) -> Iterator[str]:
+    """
+    Row 1 holds constants, every cell below reads the rectangle from A1 to
+    the cell above it, until there are max_num_edges dependencies.
+    """
+    yield "disable_output"
+    for col in range(1, NUM_COLS + 1):
+        yield f"{COLUMN_NAMES[col - 1]}1={col}"
+
+    num_edges = 0
+    last_cell = ""
+    for row in range(2, 1000):
+        for col in range(1, NUM_COLS + 1):
+            num_edges += col * (row - 1)
+            if num_edges > max_num_edges:
+                break
+            name = COLUMN_NAMES[col - 1]
+            last_cell = f"{name}{row}"
+            yield f"{name}{row}={operation}(A1:{name}{row - 1})"
+        if num_edges > max_num_edges:
+            break
+
+    if add_reassign:
+        yield "A1=1000000"
+    yield f"scroll_to {last_cell}"
+    yield "enable_output"
+
+
+def dense_rect(rx: int, ry: int, operation: str, add_reassign: bool) -> Iterator[str]:
+    """Every cell from row rx and column ry on reads the rectangle from A1 to the cell above it."""
+    yield "disable_output"
+    yield "A1=10000"
+    yield "B1=100000"
+
+    last_cell = ""
+    for row in range(rx, 1000):
+        for col in range(ry, NUM_COLS + 1):
+            name = COLUMN_NAMES[col - 1]
+            last_cell = f"{name}{row}"
+            yield f"{name}{row}={operation}(A1:{name}{row - 1})"
+
+    if add_reassign:
+        yield "A1=1000000"
+    yield f"scroll_to {last_cell}"
+    yield "enable_output"
+
+
+def range_ops(
+    col_start: int, col_end: int, row_start: int, row_end: int, operation: str, add_reassign: bool
+) -> Iterator[str]:
+    """Fills a rectangle with constants, then A1 applies operation to all of it."""
+    start_cell = f"{COLUMN_NAMES[col_start - 1]}{row_start}"
+    last_cell = f"{COLUMN_NAMES[col_end - 1]}{row_end}"
+
+    yield "disable_output"
+    for col in range(col_start, col_end + 1):
+        name = COLUMN_NAMES[col - 1]
+        for row in range(row_start, row_end + 1):
+            yield f"{name}{row}={(row * col) % 10}"
+
+    yield f"A1={operation}({start_cell}:{last_cell})"
+    if add_reassign:
+        yield f"{start_cell}=-1"
+    yield "enable_output"
+
+
+def repeated_range(num_cmds: int, add_reassign: bool, fn: str) -> Iterator[str]:
+    """num_cmds cells of column A all apply fn to B1:ALA999."""
+    yield "disable_output"
+    if add_reassign:
+        yield "B1=2000000"
+    for i in range(num_cmds):
+        yield f"A{i + 1}={fn}(B1:ALA999)"
+    if add_reassign:
+        yield "B1=1000000"
+    yield "enable_output"
+    yield "q"
+
+
+def range_chain(chain_size: int, range_width: int, add_reassign: bool) -> Iterator[str]:
+    """A chain of MAX formulas, each over the full height of the columns before it."""
+    yield "disable_output"
+    yield "A1=1000000"
+
+    to_assign = ""
+    for start_col in range(1, chain_size * range_width, range_width + 1):
+        start_cell = f"{COLUMN_NAMES[start_col - 1]}1"
+        end_cell = f"{COLUMN_NAMES[start_col + range_width - 1]}999"
+        to_assign = f"{COLUMN_NAMES[start_col + range_width]}1"
+        yield f"{to_assign}=MAX({start_cell}:{end_cell})"
+
+    if add_reassign:
+        yield "A1=2000000"
+    yield f"scroll_to {to_assign}"
+    yield "enable_output"
+    yield "q"
+
+
+def dep_chain(num_rows: int, num_cols: int) -> Iterator[str]:
+    """Every cell of a num_rows x num_cols rectangle, row by row, is the one before it plus one."""
+    yield "disable_output"
+    previous = "A1"
+    for row in range(1, num_rows + 1):
+        for col in range(1, num_cols + 1):
+            if row == 1 and col == 1:
+                continue
+            cell = f"{COLUMN_NAMES[col - 1]}{row}"
+            yield f"{cell}={previous}+1"
+            previous = cell
+    yield "A1=1"
+
+
+def random_sheet(rng: random.Random, num_commands: int, num_rows: int, num_cols: int) -> Iterator[str]:
+    """
+    num_commands random assignments on a num_rows x num_cols sheet: constants,
+    arithmetic (division by zero included) and range functions, for fuzzing
+    the graders against the oracle.
+    """
+    def cell() -> str:
+        return f"{COLUMN_NAMES[rng.randrange(num_cols)]}{rng.randrange(num_rows) + 1}"
+
+    def operand() -> str:
+        return cell() if rng.random() < 0.7 else str(rng.randint(-100, 100))
+
+    functions = ("MIN", "MAX", "SUM", "AVG", "STDEV")
+    yield "disable_output"
+    for _ in range(num_commands):
+        kind = rng.random()
+        if kind < 0.4:
+            yield f"{cell()}={rng.randint(-1000, 1000)}"
+        elif kind < 0.6:
+            yield f"{cell()}={operand()}{rng.choice('+-/')}{operand()}"
+        elif kind < 0.8:
+            # Products of cells quickly overflow an int
+            yield f"{cell()}={operand()}*{rng.randint(-2, 2)}"
+        else:
+            r0, r1 = sorted(rng.randrange(num_rows) for _ in range(2))
+            c0, c1 = sorted(rng.randrange(num_cols) for _ in range(2))
+            yield f"{cell()}={rng.choice(functions)}({COLUMN_NAMES[c0]}{r0 + 1}:{COLUMN_NAMES[c1]}{r1 + 1})"
+    yield "enable_output"
+    yield "scroll_to A1"
+
+
+def _flag(value: str) -> bool:
+    return bool(int(value))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a .cmds test case, and optionally its .exp file.")
+    parser.add_argument("--header", action="store_true", help='start with the "rows cols" line')
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random generators")
+    parser.add_argument("--exp", choices=("main", "main2", "main3"), help="also write the .exp file for this runner")
+    parser.add_argument("--timeout", type=int, help="time budget in the main2/main3 .exp file, required for them")
+    generators = parser.add_subparsers(dest="generator", required=True)
+
+    def add(name: str) -> argparse.ArgumentParser:
+        sub = generators.add_parser(name, help=globals()[name].__doc__.strip().split("\n")[0])
+        sub.add_argument("out", type=Path, help="the .cmds file to write")
+        return sub
+
+    sub = add("dense_dag")
+    sub.add_argument("max_num_edges", type=int)
+    sub.add_argument("operation", type=str.upper)
+    sub.add_argument("add_reassign", type=_flag)
+
+    sub = add("dense_rect")
+    sub.add_argument("rx", type=int)
+    sub.add_argument("ry", type=int)
+    sub.add_argument("operation", type=str.upper)
+    sub.add_argument("add_reassign", type=_flag)
+
+    sub = add("range_ops")
+    for name in ("col_start", "col_end", "row_start", "row_end"):
+        sub.add_argument(name, type=int)
+    sub.add_argument("operation", type=str.upper)
+    sub.add_argument("add_reassign", type=_flag)
+
+    sub = add("repeated_range")
+    sub.add_argument("num_cmds", type=int)
+    sub.add_argument("add_reassign", type=_flag)
+    sub.add_argument("fn")
+
+    sub = add("range_chain")
+    sub.add_argument("chain_size", type=int)
+    sub.add_argument("range_width", type=int)
+    sub.add_argument("add_reassign", type=_flag)
+
+    sub = add("dep_chain")
+    sub.add_argument("num_rows", type=int)
+    sub.add_argument("num_cols", type=int)
+
+    sub = add("random_sheet")
+    sub.add_argument("num_commands", type=int)
+    sub.add_argument("num_rows", type=int)
+    sub.add_argument("num_cols", type=int)
+
+    args = vars(parser.parse_args())
+    if args["exp"] in ("main2", "main3") and args["timeout"] is None:
+        parser.error(f"--exp {args['exp']} needs --timeout, its .exp file starts with the time budget")
+    generator = globals()[args.pop("generator")]
+    out, header, exp, timeout = args.pop("out"), args.pop("header"), args.pop("exp"), args.pop("timeout")
+    rng = random.Random(args.pop("seed"))
+    if generator is random_sheet:
+        args["rng"] = rng
+        shape = (args["num_rows"], args["num_cols"])
+    else:
+        shape = (NUM_ROWS, NUM_COLS)
+
+    num = write_commands(out, generator(**args), shape if header else None)
+    print(f"Wrote {num} commands to {out}")
+    if exp is not None:
+        import oracle
+        exp_file = out.with_suffix(".exp")
+        try:
+            expected = oracle.expected_output(out, exp, timeout)
+        except OverflowError as e:
+            print(f"No expected output, {e}; try another seed")
+            sys.exit(1)
+        with open(exp_file, "w") as f:
+            f.write(expected)
+        print(f"Wrote {exp_file}")
+
+
+if __name__ == "__main__":
+    main()